@@ -5,6 +5,17 @@ async.py -- stuff to make async easier to deal with
 import asyncio
 import prometheus_client
 
+
+def install_uvloop():
+    """Makes new event loops use uvloop if it is installed. Returns True if it was."""
+    try:
+        import uvloop
+    except ImportError:
+        return False
+    asyncio.set_event_loop_policy(uvloop.EventLoopPolicy())
+    return True
+
+
 class AsyncPollingLoop:
     AWAITING = prometheus_client.Gauge(
         'porter_num_tasks', 'number of async tasks being awaited', ['loop']
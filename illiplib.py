@@ -261,20 +261,28 @@ class IlluminationClient:
 
     async def query(self, mode, integration, action, *ignored):
         """Query a device to get its current state."""
-        if hasattr(action, "value"):
-            action = action.value
-        _LOGGER.debug(f"Sending query {mode}, integration {integration}, action {action}, ignoring {ignored}")
+        await self.query_all([(mode, integration, action, *ignored)])
+
+    async def query_all(self, queries):
+        """Send many queries at once. Each query is a tuple of the arguments to query()."""
         async with self._write_lock:
             if self._state != IlluminationClient.State.Opened:
                 return
-            if action == IlluminationClient.Button.LEDSTATE:
-                self.writer.write(f'rkls,{self.to_illumination_address(integration)}\r\n'.encode())
-            elif action == IlluminationClient.Action.SET:
-                self.writer.write(f'rdl,{self.to_illumination_address(integration)}\r\n'.encode())
-            else:
-                _LOGGER.warning(f'query(): unknown action number {action} for {integration}')
-                return
-            await self.writer.drain()
+            written = False
+            for (mode, integration, action, *ignored) in queries:
+                if hasattr(action, "value"):
+                    action = action.value
+                _LOGGER.debug(f"Sending query {mode}, integration {integration}, action {action}, ignoring {ignored}")
+                if action == IlluminationClient.Button.LEDSTATE:
+                    self.writer.write(f'rkls,{self.to_illumination_address(integration)}\r\n'.encode())
+                elif action == IlluminationClient.Action.SET:
+                    self.writer.write(f'rdl,{self.to_illumination_address(integration)}\r\n'.encode())
+                else:
+                    _LOGGER.warning(f'query(): unknown action number {action} for {integration}')
+                    continue
+                written = True
+            if written:
+                await self.writer.drain()
 
     def to_illumination_address(self, integration):
         s = str(integration)
@@ -249,16 +249,21 @@ class LipServer:
 
     async def query(self, mode, integration, action, *params):
         """Query a device to get its current state."""
-        if hasattr(action, "value"):
-            action = action.value
-        _LOGGER.debug(f"Sending query {mode}, integration {integration}, action {action}, params {params}")
+        await self.query_all([(mode, integration, action, *params)])
+
+    async def query_all(self, queries):
+        """Send many queries at once. Each query is a tuple of the arguments to query()."""
         async with self._write_lock:
             if self._state != LipServer.State.Opened:
                 return
-            pval = ','.join([str(int(p)) for p in params])
-            if pval:
-                pval = f',{pval}'
-            self.writer.write(f"?{mode},{integration},{action}{pval}\r\n".encode())
+            for (mode, integration, action, *params) in queries:
+                if hasattr(action, "value"):
+                    action = action.value
+                _LOGGER.debug(f"Sending query {mode}, integration {integration}, action {action}, params {params}")
+                pval = ','.join([str(int(p)) for p in params])
+                if pval:
+                    pval = f',{pval}'
+                self.writer.write(f"?{mode},{integration},{action}{pval}\r\n".encode())
             await self.writer.drain()
 
     async def ping(self):
@@ -9,11 +9,23 @@ See https://github.com/upsert/liplib
 and https://www.lutron.com/TechnicalDocumentLibrary/040249.pdf
 """
 
-import asyncio, illiplib, json, liplib, logging, prometheus_client, time, threading
+import asyncio, illiplib, json, liplib, logging, prometheus_client, sys, time, threading
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 LOGGER = logging.getLogger('porter.lutron')
 
+# label values are the same from one scrape to the next, so we make them once
+EMPTY = sys.intern('')
+_COMPONENT_STR = [sys.intern(str(i)) for i in range(256)]
+
+def _component_str(component):
+    return _COMPONENT_STR[component] if 0 <= component < 256 else str(component)
+
 REQUEST_TIME = prometheus_client.Summary('lutron_processing_seconds',
                                          'time of Lutron requests')
 
@@ -76,7 +88,7 @@ class ConfigParams:
 
         integration_json_string = self.lutronconfig.get('integration')
         if integration_json_string:
-            self.process_integration_report(json.loads(integration_json_string))
+            self.process_integration_report(_loads(integration_json_string))
         else:
             self._process_integration_yaml()
 
@@ -120,6 +132,7 @@ class ConfigParams:
             areaname = device.get('Area', {}).get('Name', '')
             self.deviceid_to_dimmertuple[device['ID']] = (device['Name'], areaname)
             add_device(areaname, (device['ID'], device['Name']))
+        self._make_label_caches()
 
     def _process_integration_yaml(self):
         """This processes the scenes and areas maps from the config to create the
@@ -138,6 +151,25 @@ class ConfigParams:
                     assert len(buttons) == 1, (deviceid, devicename, buttons)
                     self.deviceid_to_sensortuple[deviceid] = (devicename,
                                                               areaname, buttons[0])
+        self._make_label_caches()
+
+    def _make_label_caches(self):
+        """Precomputes the deviceId label value for every device we know about,
+        and the (deviceId, name, area) labels for every device that has an output level.
+        """
+        self.deviceid_to_str = {}
+        for deviceid in list(self.deviceid_to_dimmertuple) + list(self.deviceid_to_sensortuple):
+            self.deviceid_to_str[deviceid] = sys.intern(str(deviceid))
+        # in Illumination, dimmers are also sensors, so we label them from the sensor tuple
+        self.deviceid_to_outputlabels = {
+            deviceid: (self.deviceid_to_str[deviceid], name, area)
+            for (deviceid, (name, area, buttons)) in self.deviceid_to_sensortuple.items()
+        }
+        for (deviceid, (name, area)) in self.deviceid_to_dimmertuple.items():
+            self.deviceid_to_outputlabels[deviceid] = (self.deviceid_to_str[deviceid], name, area)
+
+    def deviceid_str(self, deviceid):
+        return self.deviceid_to_str.get(deviceid) or str(deviceid)
 
     def dump_integration_yaml_string(self):
         """Returns a YAML format string that reflects the integration.
@@ -162,6 +194,15 @@ class Lipservice:
     # other keypads have a different magic number (ugh)
     SEETOUCH_MAGIC = 80
 
+    # the handlers compare against these for every message, so look them up once
+    _PRESS = liplib.LipServer.Button.PRESS
+    _LEDSTATE = liplib.LipServer.Button.LEDSTATE
+    _SET = liplib.LipServer.Action.SET
+    _RAISING = liplib.LipServer.Action.RAISING
+    _LOWERING = liplib.LipServer.Action.LOWERING
+    _STOP = liplib.LipServer.Action.STOP
+    _PRESET = liplib.LipServer.Action.PRESET
+
     def __init__(self, host, port, cfparams, eventbus):
         self.host, self.port = host, port
         self.cfparams = cfparams
@@ -191,10 +232,23 @@ class Lipservice:
                 self.ledstates[deviceid] = {}
                 for button in buttons:
                     self.ledstates[deviceid][button] = None
-        # Hold the lock if you are going to add a key to the four dictionaries
-        # above, or if you are going to iterate over those dictionaries outside
-        # of the async task thread.
-        self.cv = threading.Condition()
+        # The four dictionaries above are only mutated by the async task thread.
+        # That thread holds the lock while it mutates them, and other threads
+        # (e.g. collect() in the scrape thread) hold it only long enough to
+        # take a snapshot. Never hold the lock across an await.
+        self.lock = threading.Lock()
+
+        # maps the mode of each message from the Lutron device to its handler
+        self._handlers = {
+            'DEVICE': self._on_device,
+            'OUTPUT': self._on_output,
+            'SHADEGRP': self._on_output,
+            'GROUP': self._on_group,
+            'TIMECLOCK': self._on_timeclock,
+            'KLS': self._on_kls,
+            'SVS': self._on_svs,
+            'ERROR': self._on_error,
+        }
 
         LOGGER.info(f'new Lutron connection to {host}:{port}')
 
@@ -208,38 +262,28 @@ class Lipservice:
         await self.open() # sets self.last_ping
         # no need to hold the lock because we are in the async task thread
         await self._query_levels()
-        # if we are in the tasks_pending set we were put there by poll(),
-        # so make sure we return to poll().
-        return self.poll()
 
     async def _query_levels(self):
         self.last_query = time.time()
         self.last_ping = self.last_query
-        for deviceid in self.outputlevels:
-            # Action.SET in a query gets the current output level
-            await self.lipserver.query('OUTPUT', deviceid, liplib.LipServer.Action.SET)
+        # Action.SET in a query gets the current output level
+        queries = [('OUTPUT', deviceid, self._SET) for deviceid in self.outputlevels]
         for (deviceid, cmap) in self.ledstates.items():
-            LEDSTATE = liplib.LipServer.Button.LEDSTATE
             if self.device_ledquery:
-                await self.lipserver.query('DEVICE', deviceid, LEDSTATE)
+                queries.append(('DEVICE', deviceid, self._LEDSTATE))
             else:
                 for button in cmap:
-                    await self.lipserver.query('DEVICE', deviceid, button+self.SEETOUCH_MAGIC, LEDSTATE)
+                    queries.append(('DEVICE', deviceid, button+self.SEETOUCH_MAGIC, self._LEDSTATE))
+        # the responses arrive asynchronously, via poll()
+        await self.lipserver.query_all(queries)
 
     async def query_levels_periodic(self):
+        """Runs forever, resynchronizing our output levels every QUERY_TIME seconds."""
         query_timeout = self.QUERY_TIME
-        while self.last_query + query_timeout > time.time():
-            await asyncio.sleep(self.last_query + query_timeout - time.time())
-        await self._query_levels()
-        return self.query_levels_periodic()
-
-    async def ping(self):
-        ping_timeout = self.PING_TIME
-        while self.last_ping + ping_timeout > time.time():
-            await asyncio.sleep(self.last_ping + ping_timeout - time.time())
-        self.last_ping = time.time()
-        await self.lipserver.ping()
-        return self.ping()
+        while True:
+            while self.last_query + query_timeout > time.time():
+                await asyncio.sleep(self.last_query + query_timeout - time.time())
+            await self._query_levels()
 
     def _fullname_for_deviceid(self, deviceid):
         (name, area, buttons) = self.cfparams.deviceid_to_sensortuple.get(deviceid, ('', '', ''))
@@ -249,142 +293,162 @@ class Lipservice:
 
     def _increment_counter(self, map_of_counters, key, increment=1):
         new_value = map_of_counters.get(key, 0) + increment
-        with self.cv:
+        with self.lock:
             map_of_counters[key] = new_value
         return new_value
 
     async def poll(self):
-        """This method is misnamed. It doesn't poll, it blocks waiting
-        for the Lutron device to emit a state change message."""
-        (a, b, c, d) = await self.lipserver.read()
-        if a is None:
-            # then try to reconnect -- and since we may have missed
-            # state updates while we were disconnected, we need to call
-            # open_and_query_levels() to refresh our current state. happily,
-            # open_and_query_levels() also reconnects us.
-            #
-            # remember that the way we have set up the wait() loop, when
-            # a task in the wait() loop finishes, we create a new task
-            # with the return value of the old task.
-            return self.open_and_query_levels()
-        elif a == 'DEVICE':
-            if isinstance(d, tuple):
-                deviceid, component, action, param = int(b), int(c), int(d[0]), float(d[1])
+        """This method is misnamed. It doesn't poll, it opens the connection
+        and then runs forever, blocking until the Lutron device emits a state
+        change message and then handling it."""
+        await self.open_and_query_levels()
+        while True:
+            (a, b, c, d) = await self.lipserver.read()
+            if a is None:
+                # then try to reconnect -- and since we may have missed
+                # state updates while we were disconnected, we need to call
+                # open_and_query_levels() to refresh our current state. happily,
+                # open_and_query_levels() also reconnects us.
+                await self.open_and_query_levels()
             else:
-                deviceid, component, action = int(b), int(c), int(d)
-            self.last_ping = time.time()
-            if action == liplib.LipServer.Button.PRESS:
-                if deviceid == 1: # then a scene was triggered
-                    count = self._increment_counter(self.counts_by_scene_number, component)
-                    self.eventbus.propagate((deviceid, 'scene', component))
-                else: # a standalone device
-                    count = self._increment_counter(self.counts_by_deviceid_component, (deviceid, component))
-                    fullname = self._fullname_for_deviceid(deviceid)
-                    self.eventbus.propagate((deviceid, fullname, component))
-            elif action == liplib.LipServer.Button.LEDSTATE:
-                if component > self.SEETOUCH_MAGIC and component < 20 + self.SEETOUCH_MAGIC:
-                    component -= self.SEETOUCH_MAGIC
-                cmap = self.ledstates.get(deviceid)
-                if cmap is None:
-                    cmap = {}
+                self._handlers.get(a, self._on_unknown)(a, b, c, d)
+
+    def _on_device(self, a, b, c, d):
+        if isinstance(d, tuple):
+            deviceid, component, action, param = int(b), int(c), int(d[0]), float(d[1])
+        else:
+            deviceid, component, action = int(b), int(c), int(d)
+        self.last_ping = time.time()
+        if action == self._PRESS:
+            if deviceid == 1: # then a scene was triggered
+                self._increment_counter(self.counts_by_scene_number, component)
+                self.eventbus.propagate((deviceid, 'scene', component))
+            else: # a standalone device
+                self._increment_counter(self.counts_by_deviceid_component, (deviceid, component))
+                fullname = self._fullname_for_deviceid(deviceid)
+                self.eventbus.propagate((deviceid, fullname, component))
+        elif action == self._LEDSTATE:
+            if component > self.SEETOUCH_MAGIC and component < 20 + self.SEETOUCH_MAGIC:
+                component -= self.SEETOUCH_MAGIC
+            cmap = self.ledstates.get(deviceid)
+            if cmap is None:
+                cmap = {}
+                with self.lock:
                     self.ledstates[deviceid] = cmap
-                ival = int(param)
-                previous = cmap.get(component)
-                if previous != ival and previous is not None:
-                    fullname = self._fullname_for_deviceid(deviceid)
-                    self.eventbus.propagate((deviceid, fullname, 'ledstate', component, ival))
+            ival = int(param)
+            previous = cmap.get(component)
+            if previous != ival and previous is not None:
+                fullname = self._fullname_for_deviceid(deviceid)
+                self.eventbus.propagate((deviceid, fullname, 'ledstate', component, ival))
+            with self.lock:
                 cmap[component] = ival
-            # We ignore button releases even though that is where the action is taken.
-            # Thus we also ignore double-press and long-press that can be reported
-            # by Homeworks QS.
-        elif a == 'OUTPUT' or a == 'SHADEGRP':
-            # SHADEGRP is reported by Homeworks QS
-            deviceid, action, level = b, c, d
-            self.last_ping = time.time()
-            if action == liplib.LipServer.Action.SET:
-                previous = self.outputlevels.get(deviceid)
-                if previous != level and previous is not None:
+        # We ignore button releases even though that is where the action is taken.
+        # Thus we also ignore double-press and long-press that can be reported
+        # by Homeworks QS.
+
+    def _on_output(self, a, b, c, d):
+        # SHADEGRP is reported by Homeworks QS
+        deviceid, action, level = b, c, d
+        self.last_ping = time.time()
+        if action == self._SET:
+            # most SET frames re-report an unchanged level, so only take the
+            # lock (and contend with collect()) when the level actually moves
+            previous = self.outputlevels.get(deviceid)
+            if previous != level:
+                if previous is not None:
                     fullname = self._fullname_for_deviceid(deviceid)
                     self.eventbus.propagate((deviceid, fullname, 'level', level))
-                self.outputlevels[deviceid] = level
-            elif action == liplib.LipServer.Action.RAISING:
-                # outputlevel will be reported later
-                fullname = self._fullname_for_deviceid(deviceid)
-                self.eventbus.propagate((deviceid, fullname, 'raising'))
-            elif action == liplib.LipServer.Action.LOWERING:
-                # outputlevel will be reported later
-                fullname = self._fullname_for_deviceid(deviceid)
-                self.eventbus.propagate((deviceid, fullname, 'lowering'))
-            elif action == liplib.LipServer.Action.STOP:
-                fullname = self._fullname_for_deviceid(deviceid)
-                self.eventbus.propagate((deviceid, fullname, 'stop'))
-            elif a == 'SHADEGRP' and action == liplib.LipServer.Action.PRESET:
-                pass # for Homeworks QS: activate the preset of a shade group
-            elif action == 29 or action == 30:
-                # These are reported by Homeworks QS and possibly others (though NOT
-                # Radio Ra2 Select) and are not documented in the Homeworks Integration
-                # Guide. I have no idea about action 30. For action 29:
-                #    if value is 6, the previous change was caused by an integration command
-                #       (i.e. something we might write)
-                #    if value is 8, the change was caused by a keypad buttonpress
-                #    if value is 10, it was caused by a motion sensor for "occupancy"
-                #    if value is 11, it was caused by a motion sensor for "vacancy"
-                pass
-            else:
-                LOGGER.warning(f'unknown ~OUTPUT action {action} for deviceid {deviceid} level {level} on  {self.host}:{self.port}')
-        elif a == 'GROUP':
-            # emitted by Homeworks QS to show occupancy status of an occupancy sensor group.
-            # param of 3 means occupied, 4 means unoccupied, 255 is unknown
-            deviceid, action, param = b, c, d
-            self.last_ping = time.time()
-            if action == 3:
-                val = 100 if param == 3 else 0 if param == 4 else -1
-                if val == -1:
-                    LOGGER.warning(f'unknown GROUP param {param} for deviceid {deviceid} on  {self.host}:{self.port}')
-                fullname = self._fullname_for_deviceid(deviceid)
-                self.eventbus.propagate((deviceid, fullname, 'occupancy', val))
-                self.outputlevels[deviceid] = val
-            else:
-                LOGGER.warning(f'unknown GROUP action {action} {param} for deviceid {deviceid} on {self.host}:{self.port}')
-        elif a == 'TIMECLOCK':
-            deviceid, component, action = int(b), int(c), int(d)
-            self.last_ping = time.time()
-            if action == 1:
-                pass # current timeclock mode
-            elif action == 2:
-                pass # sunrise
-            elif action == 3:
-                pass # sunset
-            elif action == 5:
-                pass # executing an indexed event
-        elif a == 'KLS': # reported by Homeworks Illumination
-            deviceid, ledstates = int(b), str(int(c))
-            self.last_ping = time.time()
+                with self.lock:
+                    self.outputlevels[deviceid] = level
+        elif action == self._RAISING:
+            # outputlevel will be reported later
             fullname = self._fullname_for_deviceid(deviceid)
-            leadingzeroes = 24 - len(ledstates)
-            cmap = self.ledstates.get(deviceid)
-            if cmap is None:
-                cmap = {}
+            self.eventbus.propagate((deviceid, fullname, 'raising'))
+        elif action == self._LOWERING:
+            # outputlevel will be reported later
+            fullname = self._fullname_for_deviceid(deviceid)
+            self.eventbus.propagate((deviceid, fullname, 'lowering'))
+        elif action == self._STOP:
+            fullname = self._fullname_for_deviceid(deviceid)
+            self.eventbus.propagate((deviceid, fullname, 'stop'))
+        elif a == 'SHADEGRP' and action == self._PRESET:
+            pass # for Homeworks QS: activate the preset of a shade group
+        elif action == 29 or action == 30:
+            # These are reported by Homeworks QS and possibly others (though NOT
+            # Radio Ra2 Select) and are not documented in the Homeworks Integration
+            # Guide. I have no idea about action 30. For action 29:
+            #    if value is 6, the previous change was caused by an integration command
+            #       (i.e. something we might write)
+            #    if value is 8, the change was caused by a keypad buttonpress
+            #    if value is 10, it was caused by a motion sensor for "occupancy"
+            #    if value is 11, it was caused by a motion sensor for "vacancy"
+            pass
+        else:
+            LOGGER.warning(f'unknown ~OUTPUT action {action} for deviceid {deviceid} level {level} on  {self.host}:{self.port}')
+
+    def _on_group(self, a, b, c, d):
+        # emitted by Homeworks QS to show occupancy status of an occupancy sensor group.
+        # param of 3 means occupied, 4 means unoccupied, 255 is unknown
+        deviceid, action, param = b, c, d
+        self.last_ping = time.time()
+        if action == 3:
+            val = 100 if param == 3 else 0 if param == 4 else -1
+            if val == -1:
+                LOGGER.warning(f'unknown GROUP param {param} for deviceid {deviceid} on  {self.host}:{self.port}')
+            fullname = self._fullname_for_deviceid(deviceid)
+            self.eventbus.propagate((deviceid, fullname, 'occupancy', val))
+            if self.outputlevels.get(deviceid) != val:
+                with self.lock:
+                    self.outputlevels[deviceid] = val
+        else:
+            LOGGER.warning(f'unknown GROUP action {action} {param} for deviceid {deviceid} on {self.host}:{self.port}')
+
+    def _on_timeclock(self, a, b, c, d):
+        action = int(d)
+        self.last_ping = time.time()
+        if action == 1:
+            pass # current timeclock mode
+        elif action == 2:
+            pass # sunrise
+        elif action == 3:
+            pass # sunset
+        elif action == 5:
+            pass # executing an indexed event
+
+    def _on_kls(self, a, b, c, d):
+        # reported by Homeworks Illumination
+        deviceid, ledstates = int(b), str(int(c))
+        self.last_ping = time.time()
+        fullname = self._fullname_for_deviceid(deviceid)
+        leadingzeroes = 24 - len(ledstates)
+        cmap = self.ledstates.get(deviceid)
+        if cmap is None:
+            cmap = {}
+            with self.lock:
                 self.ledstates[deviceid] = cmap
-            def set_cmap(component, val):
-                previous = cmap.get(component)
-                if previous != val and previous is not None:
-                    self.eventbus.propagate((deviceid, fullname, 'ledstate', component, val))
+        def set_cmap(component, val):
+            previous = cmap.get(component)
+            if previous != val and previous is not None:
+                self.eventbus.propagate((deviceid, fullname, 'ledstate', component, val))
+            with self.lock:
                 cmap[component] = val
-            for z in range(leadingzeroes):
-                set_cmap(z+1, 0)
-            for (count, val) in enumerate(ledstates):
-                # 6 is undocumented but so far seen only on CCI inputs.
-                # 9 is undocumented and seems to correspond to LED off.
-                ival = 0 if val == '9' else int(val)
-                set_cmap(count+leadingzeroes+1, ival)
-        elif a == 'SVS': # reported by Illumination but illiplib doesn't support
-            self.last_ping = time.time()
-        elif a == 'ERROR':
-            LOGGER.error(f'~ERROR while polling {self.host}:{self.port}: {b} {c} {d}')
-        else:
-            LOGGER.warning(f'unknown response while polling {self.host}:{self.port}: {a} {b} {c} {d}')
-        return self.poll() # return ourselves as coroutine so we are restarted
+        for z in range(leadingzeroes):
+            set_cmap(z+1, 0)
+        for (count, val) in enumerate(ledstates):
+            # 6 is undocumented but so far seen only on CCI inputs.
+            # 9 is undocumented and seems to correspond to LED off.
+            ival = 0 if val == '9' else int(val)
+            set_cmap(count+leadingzeroes+1, ival)
+
+    def _on_svs(self, a, b, c, d):
+        # reported by Illumination but illiplib doesn't support
+        self.last_ping = time.time()
+
+    def _on_error(self, a, b, c, d):
+        LOGGER.error(f'~ERROR while polling {self.host}:{self.port}: {b} {c} {d}')
+
+    def _on_unknown(self, a, b, c, d):
+        LOGGER.warning(f'unknown response while polling {self.host}:{self.port}: {a} {b} {c} {d}')
 
     async def run(self, deviceid, buttons, level, command, args):
         """Run command(args) on deviceid. Level is None or a percentage of full output."""
@@ -421,19 +485,25 @@ class Lipservice:
 
 
 class LipserviceManager:
+    KEEPALIVE_INTERVAL = 60 # number of seconds between checks for idle connections
+    RESTART_DELAY = 10 # number of seconds before restarting a failed connection task
+
     def __init__(self, eventbus):
         self.eventbus = eventbus
-        self.cv = threading.Condition()
+        self._lock = threading.Lock() # guards target_to_cfparams and new_targets
         self.target_to_cfparams = {}
+        self.new_targets = set() # registered but not yet connected by poll()
         self.hostport_to_lipservice = {}
-        self.tasks_pending = set()
+        self.tasks = set() # the event loop only keeps weak references to tasks
+        self.keepalive_started = False
 
     def register_target(self, lutronconfig, target):
-        with self.cv:
+        with self._lock:
             cfparams = self.target_to_cfparams.get(target)
             if not cfparams:
                 cfparams = ConfigParams(lutronconfig, target)
                 self.target_to_cfparams[target] = cfparams
+                self.new_targets.add(target)
             return cfparams
 
     def get_lipservice_for_target(self, target):
@@ -441,39 +511,67 @@ class LipserviceManager:
         port = int(portstr or 23)
         return self.hostport_to_lipservice.get((host, port))
 
+    async def _keepalive(self):
+        """Runs forever, pinging each connection that has been idle for its PING_TIME.
+        One task serves every connection so that we don't need a timer for each.
+        """
+        while True:
+            await asyncio.sleep(self.KEEPALIVE_INTERVAL)
+            now = time.time()
+            for lips in list(self.hostport_to_lipservice.values()):
+                if now - lips.last_ping > lips.PING_TIME:
+                    lips.last_ping = now
+                    await lips.lipserver.ping()
+
+    def _spawn(self, factory, restart=False):
+        """Runs factory() as a task. If restart is true, the task runs forever
+        and we start a fresh one RESTART_DELAY seconds after it fails.
+        """
+        task = asyncio.create_task(factory())
+        self._watch(task, factory if restart else None)
+
+    def _watch(self, task, restart=None):
+        self.tasks.add(task)
+        task.add_done_callback(lambda t: self._on_task_done(t, restart))
+
+    def _on_task_done(self, task, restart):
+        self.tasks.discard(task)
+        if task.cancelled():
+            return
+        exc = task.exception()
+        if exc:
+            LOGGER.error(f'exception in Lutron task {task.get_name()}', exc_info=exc)
+        if restart:
+            asyncio.get_running_loop().call_later(self.RESTART_DELAY, self._spawn, restart, True)
+
     async def poll(self, timeout=1):
-        with self.cv:
-            targets = [t for t in self.target_to_cfparams.items()]
-        for (target, cfparam) in targets:
+        with self._lock:
+            (targets, self.new_targets) = (self.new_targets, set())
+        for target in targets:
+            cfparam = self.target_to_cfparams[target]
             (host, colon, portstr) = target.partition(':')
             port = int(portstr or 23)
             lips = self.hostport_to_lipservice.get((host, port))
             if not lips:
                 lips = Lipservice(host, port, cfparam, self.eventbus.target(target))
                 self.hostport_to_lipservice[(host, port)] = lips
-                # open_and_query_levels() will return poll() so that's what we'll do next
-                self.tasks_pending.add(asyncio.create_task(lips.open_and_query_levels()))
-                self.tasks_pending.add(asyncio.create_task(lips.query_levels_periodic()))
-                self.tasks_pending.add(asyncio.create_task(lips.ping()))
+                # these tasks run for as long as we do
+                self._spawn(lips.poll, restart=True)
+                self._spawn(lips.query_levels_periodic, restart=True)
+                if not self.keepalive_started:
+                    self.keepalive_started = True
+                    self._spawn(self._keepalive, restart=True)
+        # The connection tasks don't need us to wait on them: the event loop
+        # runs them and _on_task_done() reports their failures. We only have
+        # to start the reactions the eventbus has queued up since last time.
         new_awaitables = set()
         self.eventbus.add_awaitables_to(new_awaitables)
         for awaitable in new_awaitables:
             if isinstance(awaitable, asyncio.Task):
-                self.tasks_pending.add(awaitable)
+                self._watch(awaitable)
             else:
-                self.tasks_pending.add(asyncio.create_task(awaitable))
-
-        if self.tasks_pending:
-            (done, self.tasks_pending) = await asyncio.wait(
-                self.tasks_pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
-            for task in done:
-                # As each poll() or ping() completes, schedule it to run again.
-                # If task exited with an exception, result() will raise it now.
-                r = task.result()
-                if r:
-                    self.tasks_pending.add(asyncio.create_task(r))
-        else:
-            await asyncio.sleep(timeout)
+                self._watch(asyncio.create_task(awaitable))
+        await asyncio.sleep(timeout)
 
 
 class LutronClient:
@@ -500,21 +598,21 @@ class LutronClient:
             return
         def is_selected(deviceid, name, area):
             return str(selector) == str(deviceid) or str(name).startswith(str(selector))
-        with lips.cv:
+        with lips.lock:
             t = self._get_annotated_outputlevels_locked(lips, cfparams)
-            for (deviceid, level, name, area, *buttons) in t:
-                if is_selected(deviceid, name, area):
-                    await lips.run(deviceid, buttons, level, command, args)
-                    return
-            for (deviceid, sensortuple) in cfparams.deviceid_to_sensortuple.items():
-                (name, area, buttons) = sensortuple
-                if is_selected(deviceid, name, area):
-                    await lips.run(deviceid, buttons, None, command, args)
-                    return
+        for (deviceid, level, name, area, *buttons) in t:
+            if is_selected(deviceid, name, area):
+                await lips.run(deviceid, buttons, level, command, args)
+                return
+        for (deviceid, sensortuple) in cfparams.deviceid_to_sensortuple.items():
+            (name, area, buttons) = sensortuple
+            if is_selected(deviceid, name, area):
+                await lips.run(deviceid, buttons, None, command, args)
+                return
         LOGGER.warning(f'run() on {target} selected empty set {selector}')
 
     def _get_annotated_outputlevels_locked(self, lips, cfparams):
-        """must hold lips.cv when you call this"""
+        """must hold lips.lock when you call this"""
         def annotate(deviceid):
             (name, area) = cfparams.deviceid_to_dimmertuple.get(deviceid, (None, ''))
             if name is None:
@@ -545,34 +643,55 @@ class LutronClient:
             labels=['deviceId', 'name', 'button', 'area', 'scene_number'],
             created=self.clientstarttime
         )
-        with lips.cv:
-            t = self._get_annotated_outputlevels_locked(lips, cfparams)
-            for (deviceid, level, name, area, *buttons) in t:
-                if level is not None:
-                    gmf.add_metric([str(deviceid), name, area], level)
-
-            for (deviceid, cmap) in lips.ledstates.items():
-                (name, area, buttons) = cfparams.deviceid_to_sensortuple.get(deviceid, ('', '', []))
-                for component in buttons:
-                    state = cmap.get(component)
-                    if state is not None:
-                        gmfled.add_metric([str(deviceid), name, str(component), area], state)
-
-            for (sceneid, count) in lips.counts_by_scene_number.items():
-                name = cfparams.sceneid_to_name.get(sceneid, '')
-                cmf.add_metric(['', name, '', '', str(sceneid)], count)
-            for (tup, count) in lips.counts_by_deviceid_component.items():
-                (deviceid, component) = tup
-                (name, area, buttons) = cfparams.deviceid_to_sensortuple.get(deviceid, (None, '', []))
-                if name is None:
-                    (name, area) = cfparams.deviceid_to_dimmertuple.get(deviceid, ('', ''))
-                cmf.add_metric([str(deviceid), name, str(component), area], count)
+        # take a snapshot under the lock, then build the metrics without it
+        with lips.lock:
+            levels = list(lips.outputlevels.items())
+            ledstates = [(deviceid, dict(cmap)) for (deviceid, cmap) in lips.ledstates.items()]
+            scenecounts = list(lips.counts_by_scene_number.items())
+            devicecounts = list(lips.counts_by_deviceid_component.items())
+
+        # We report every known level on every scrape, changed or not: Prometheus
+        # treats a series that is missing from a scrape as stale, so skipping
+        # unchanged levels would make them vanish from queries.
+        # local bindings for the loops below, which run once per device
+        outputlabels = cfparams.deviceid_to_outputlabels
+        sensortuples = cfparams.deviceid_to_sensortuple
+        dimmertuples = cfparams.deviceid_to_dimmertuple
+        deviceid_str = cfparams.deviceid_str
+        add = gmf.add_metric
+        for (deviceid, level) in levels:
+            if level is not None:
+                labels = outputlabels.get(deviceid)
+                if labels is None: # e.g. a GROUP that isn't in the integration
+                    labels = (str(deviceid), EMPTY, EMPTY)
+                add(labels, level)
+
+        add = gmfled.add_metric
+        for (deviceid, cmap) in ledstates:
+            (name, area, buttons) = sensortuples.get(deviceid, (EMPTY, EMPTY, []))
+            for component in buttons:
+                state = cmap.get(component)
+                if state is not None:
+                    add([deviceid_str(deviceid), name, _component_str(component), area], state)
+
+        add = cmf.add_metric
+        for (sceneid, count) in scenecounts:
+            name = cfparams.sceneid_to_name.get(sceneid, EMPTY)
+            add([EMPTY, name, EMPTY, EMPTY, _component_str(sceneid)], count)
+        for (tup, count) in devicecounts:
+            (deviceid, component) = tup
+            (name, area, buttons) = sensortuples.get(deviceid, (None, EMPTY, []))
+            if name is None:
+                (name, area) = dimmertuples.get(deviceid, (EMPTY, EMPTY))
+            add([deviceid_str(deviceid), name, _component_str(component), area], count)
 
         return [gmf, gmfled, cmf]
 
 if __name__ == '__main__':
     import sys, yaml
+    from asynchelpers import install_uvloop
     assert len(sys.argv) == 3, sys.argv
+    install_uvloop()
     config = yaml.safe_load(open(sys.argv[1]))
     client = LutronClient(config)
     cfparams = ConfigParams(config.get('lutron'), sys.argv[2])
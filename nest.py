@@ -10,8 +10,14 @@ See https://developers.google.com/nest/device-access/api/thermostat
 
 import json, prometheus_client, requests, time, threading
 #from dateutil.parser import isoparse
+from requests.adapters import HTTPAdapter
 from prometheus_client.core import GaugeMetricFamily
 
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
+
 
 REQUEST_TIME = prometheus_client.Summary('nest_processing_seconds',
                                          'time of nest requests')
@@ -19,6 +25,49 @@ REQUEST_TIME = prometheus_client.Summary('nest_processing_seconds',
 class NestError(Exception):
     pass
 
+def _is_not_off(v):
+    return v.lower() != 'off'
+
+def _is(expected):
+    return lambda v: v.lower() == expected
+
+# Maps (trait, field) to the gauges we derive from that field. Each gauge is
+# (metric, description, function that maps the raw value to the gauge value
+# or None to use the raw value). We don't label the gauges with the raw value:
+# the booleans already encode it, and a label would start a new time series
+# every time it changed.
+_TRAIT_GAUGES = {
+    ('sdm.devices.traits.Humidity', 'ambientHumidityPercent'): [
+        ('humidity_pct', 'percent ambient humidity', None),
+    ],
+    ('sdm.devices.traits.Temperature', 'ambientTemperatureCelsius'): [
+        ('temp_c', 'ambient temperature (degrees Celsius)', None),
+    ],
+    ('sdm.devices.traits.Connectivity', 'status'): [
+        ('is_online', 'true if is online', _is('online')),
+    ],
+    ('sdm.devices.traits.Fan', 'timerMode'): [
+        ('fan_manual_on', 'true if fan is manually on', _is_not_off),
+    ],
+    ('sdm.devices.traits.ThermostatMode', 'mode'): [
+        (f'thermostat_mode_is_{mode}', f'true if thermostat mode is {mode.upper()}', _is(mode))
+        for mode in ['heat', 'cool', 'heatcool', 'off']
+    ],
+    ('sdm.devices.traits.ThermostatEco', 'mode'): [
+        ('thermostat_eco_on', 'true if in manual eco mode', _is_not_off),
+    ],
+    ('sdm.devices.traits.ThermostatHvac', 'status'): [
+        (f'thermostat_state_is_{state}', f'true if thermostat state is {state.upper()}', _is(state))
+        for state in ['heating', 'cooling']
+    ],
+    ('sdm.devices.traits.ThermostatTemperatureSetpoint', 'heatCelsius'): [
+        ('thermostat_heat_setpoint_c', 'thermostat heat setpoint (deg Celsius)', None),
+    ],
+    ('sdm.devices.traits.ThermostatTemperatureSetpoint', 'coolCelsius'): [
+        ('thermostat_cool_setpoint_c', 'thermostat cool setpoint (deg Celsius)', None),
+    ],
+}
+
 class NestClient:
     OAUTH_PREFIX = 'https://www.googleapis.com/oauth2/v4/token?grant_type=refresh_token'
     API_PREFIX = 'https://smartdevicemanagement.googleapis.com/v1/enterprises/'
@@ -40,39 +89,58 @@ class NestClient:
             raise Exception('no nest credentials')
         if not nconfig.get('timeout'):
             nconfig['timeout'] = 10
+        # the config doesn't change after startup, so pull out what we use
+        self._projectid = nconfig['projectid']
+        self._timeout = nconfig['timeout']
+        self._credentials = nconfig['credentials']
+        self._clientid = nconfig['clientid']
+        self._clientsecret = nconfig['clientsecret']
+        self._api_prefix = f'{self.API_PREFIX}{self._projectid}'
+        # Every request goes to one of two Google hosts, so we share one session
+        # (and its connection pool) among all the scrape threads to avoid a new
+        # TLS handshake on each request.
+        self.session = requests.Session()
+        self.session.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=8))
 
     def _fetch_token_json(self, user):
         # holding self.cv
-        nconfig = self.config['nest']
-        timeout = nconfig['timeout']
-        refresh_token = nconfig['credentials'].get(user)
+        refresh_token = self._credentials.get(user)
         if refresh_token is None:
             raise NestError(f'no credentials for {user}')
-        resp = requests.post(f'{self.OAUTH_PREFIX}&client_id={nconfig["clientid"]}&client_secret={nconfig["clientsecret"]}&refresh_token={refresh_token}', timeout=timeout)
+        # the secrets go in the body so they don't end up in proxy or server logs
+        data = { 'client_id': self._clientid,
+                 'client_secret': self._clientsecret,
+                 'refresh_token': refresh_token }
+        resp = self.session.post(self.OAUTH_PREFIX, data=data, timeout=self._timeout)
         resp.raise_for_status()
-        return resp.json()
+        return _loads(resp.content)
 
     def get_access_token(self, user):
+        # self.accesstokens maps user to (access_token, refetch_at), where
+        # refetch_at is on the time.monotonic() clock. Replacing a tuple is atomic,
+        # so we only need the lock when the token has to be refreshed.
+        t = self.accesstokens.get(user)
+        if t and time.monotonic() < t[1]:
+            return t[0]
         with self.cv:
-            d = self.accesstokens.get(user, {})
-            refetch_at = d.get('expires_in', 0)/2 + d.get('fetched_at', 0)
-            now = time.time()
-            if refetch_at <= now:
-                newd = self._fetch_token_json(user)
-                if newd:
-                    newd['fetched_at'] = now
-                    self.accesstokens[user] = newd
-                    d = newd
-            if not d:
+            t = self.accesstokens.get(user) # another thread may have refreshed it
+            now = time.monotonic()
+            if t and now < t[1]:
+                return t[0]
+            newd = self._fetch_token_json(user)
+            if newd:
+                t = (newd['access_token'], now + newd.get('expires_in', 0)/2)
+                self.accesstokens[user] = t
+            if not t:
                 raise NestError(f'could not refresh {user}')
-            return d['access_token']
+            return t[0]
 
     def bearer_json_request(self, access_token, command, path, data=None):
         # e.g. path is /devices
-        endpoint = f'{self.API_PREFIX}{self.config["nest"]["projectid"]}{path}'
+        endpoint = f'{self._api_prefix}{path}'
         headers = { 'Content-Type': 'application/json',
                     'Authorization': f'Bearer {access_token}' }
-        timeout = self.config['nest']['timeout']
+        timeout = self._timeout
         if data: # depending on command, data may not be allowed as an argument
             resp = command(endpoint, headers=headers, timeout=timeout, data=data)
         else:
@@ -80,24 +148,24 @@ class NestClient:
         resp.raise_for_status()
         if resp.status_code == 204:
             return None
-        return resp.json()
+        return _loads(resp.content)
 
     @REQUEST_TIME.time()
     def collect(self, target):
         """get the status of all devices"""
 
         metric_to_gauge = {}
-        def makegauge(metric, desc, morelabels=[]):
+        def makegauge(metric, desc):
             already = metric_to_gauge.get(metric)
             if already:
                 return already
-            labels = ['deviceId', 'nameLabel', 'location', 'room'] + morelabels
+            labels = ['deviceId', 'nameLabel', 'location', 'room']
             gmf = GaugeMetricFamily(metric, desc, labels=labels)
             metric_to_gauge[metric] = gmf
             return gmf
 
         token = self.get_access_token(target)
-        resp = self.bearer_json_request(token, requests.get, '/devices')
+        resp = self.bearer_json_request(token, self.session.get, '/devices')
         for device in resp.get('devices', []):
             deviceid = device['name'].split('/')[-1] # last path component is the deviceid
             basetype = device['type'].split('.')[-1].lower() # e.g. 'thermostat'
@@ -110,58 +178,13 @@ class NestClient:
                     path = p.split('/')
                     location = '/'.join(path[2:4])
                     roomname = d.get('displayName')
-            labelvalues = [deviceid, customname, location, roomname]
+            labelvalues = (deviceid, customname, location, roomname)
 
             for (n, d) in device.get('traits', {}).items():
                 for (nn, vv) in d.items():
-                    if nn == 'ambientHumidityPercent':
-                        g = makegauge('humidity_pct', 'percent ambient humidity')
-                        g.add_metric(labelvalues, vv)
-                    elif nn == 'ambientTemperatureCelsius':
-                        g = makegauge('temp_c', 'ambient temperature (degrees Celsius)')
-                        g.add_metric(labelvalues, vv)
-                    elif n == 'sdm.devices.traits.Connectivity' and nn == 'status':
-                        online = (vv.lower() == 'online')
-                        g = makegauge('is_online', 'true if is online',
-                                      morelabels=['state'])
-                        g.add_metric(labelvalues + [vv], online)
-                    elif n == 'sdm.devices.traits.Fan' and nn == 'timerMode':
-                        on = (vv.lower() != 'off')
-                        g = makegauge('fan_manual_on', 'true if fan is manually on',
-                                      morelabels=['state'])
-                        g.add_metric(labelvalues + [vv], on)
-                    elif n == 'sdm.devices.traits.ThermostatMode' and nn == 'mode':
-                        def makeit(mode):
-                            g = makegauge(f'thermostat_mode_is_{mode.lower()}',
-                                          f'true if thermostat mode is {mode.upper()}',
-                                          morelabels=['state'])
-                            g.add_metric(labelvalues + [vv], vv.lower() == mode.lower())
-                        makeit('heat')
-                        makeit('cool')
-                        makeit('heatcool')
-                        makeit('off')
-                    elif n == 'sdm.devices.traits.ThermostatEco' and nn == 'mode':
-                        on = (vv.lower() != 'off')
-                        g = makegauge('thermostat_eco_on', 'true if in manual eco mode',
-                                      morelabels=['state'])
-                        g.add_metric(labelvalues + [vv], on)
-                    elif n == 'sdm.devices.traits.ThermostatHvac' and nn == 'status':
-                        def makeit(state):
-                            g = makegauge(f'thermostat_state_is_{state.lower()}',
-                                          f'true if thermostat state is {state.upper()}',
-                                          morelabels=['state'])
-                            g.add_metric(labelvalues + [vv], vv.lower() == state.lower())
-                        makeit('heating')
-                        makeit('cooling')
-                    elif n == 'sdm.devices.traits.ThemostatTemperatureSetpoint':
-                        if nn == 'heatCelsius':
-                            gheat = makegauge('thermostat_heat_setpoint_c',
-                                              'thermostat heat setpoint (deg Celsius)')
-                            gheat.add_metric(labelvalues, vv)
-                        elif nn == 'coolCelsius':
-                            gcool = makegauge('thermostat_cool_setpoint_c',
-                                              'thermostat cool setpoint (deg Celsius)')
-                            gcool.add_metric(labelvalues, vv)
+                    for (metric, desc, fn) in _TRAIT_GAUGES.get((n, nn), ()):
+                        g = makegauge(metric, desc)
+                        g.add_metric(labelvalues, fn(vv) if fn else vv)
 
         return metric_to_gauge.values()
 
@@ -291,7 +314,7 @@ if __name__ == '__main__':
             client = NestClient(config)
             for (target, refresh) in creds.items():
                 token = client.get_access_token(target)
-                resp = client.bearer_json_request(token, requests.get, '/devices')
+                resp = client.bearer_json_request(token, client.session.get, '/devices')
                 print(f'***************** {target}')
                 print(json.dumps(resp, indent=2))
         else:
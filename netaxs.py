@@ -14,15 +14,24 @@ update the device firmware.
 TODO: fix file descriptor leak when initial login fails due to ReadTimeout
 """
 
-import asyncio, json, logging, time, threading, ssl
-import requests, prometheus_client, pytz, websockets
+import asyncio, csv, json, logging, time, threading, ssl
+import requests, prometheus_client, websockets
 
-from datetime import datetime
+from collections import defaultdict, namedtuple
+from datetime import datetime, timedelta
 from enum import Enum
+from zoneinfo import ZoneInfo
+from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 from prometheus_client.core import GaugeMetricFamily, CounterMetricFamily
+from prometheus_client.samples import Sample
 
-from asynchelpers import AsyncPollingLoop
+from asynchelpers import AsyncPollingLoop, install_uvloop
+
+try:
+    from orjson import loads as _loads
+except ImportError:
+    from json import loads as _loads
 
 REQUEST_TIME = prometheus_client.Summary('netaxs_processing_seconds',
                                          'time of netaxs requests')
@@ -36,53 +45,176 @@ class NetaxsError(Exception):
     pass
 
 
+# the kinds of event we count; NetaxsClient._update_one_event dispatches on these
+(KIND_CARD_FOUND, KIND_VIP_CARD_FOUND, KIND_CARD_NOT_FOUND, KIND_TIMEZONE,
+ KIND_DATABASE_UPDATE, KIND_ONLINE, KIND_TROUBLE, KIND_UNKNOWN) = range(8)
+
+# maps (type, subtype) of a panel event to its (description, kind); get_events()
+# overrides a couple of these depending on other fields of the event
+_EVENT_DESC = {
+    (1, 0): ('Card Found', KIND_CARD_FOUND), # or 'online' if the code is 0
+    (1, 2): ('common database update', KIND_DATABASE_UPDATE),
+    (1, 3): ('panel database update [post-upgrade]', KIND_DATABASE_UPDATE),
+    (2, 0): ('EVL controller offline', KIND_TROUBLE),
+    (2, 1): ('Card Not Found', KIND_CARD_NOT_FOUND), # or 'TAMPER' if the space is 1
+    (2, 2): ('panel database update [type 2]', KIND_DATABASE_UPDATE),
+    (12, 0): ('VIP Card Found', KIND_VIP_CARD_FOUND),
+    (11, 1): ('Card Not Found: expired', KIND_CARD_NOT_FOUND),
+    (142, 0): ('firmware update in progress', KIND_UNKNOWN),
+    (130, 1): ('panel restarted', KIND_TROUBLE), # firmware revision in reader field
+    (5, 1): ('timezone violation', KIND_TIMEZONE),
+}
+# the (description prefix, kind) of events of a known type but unknown subtype;
+# type 2 events are trouble, so an unknown one still counts as tamper
+_UNKNOWN_EVENT_PREFIX = {
+    1: ('unknown type 1 [good, found, success]', KIND_UNKNOWN),
+    2: ('unknown type 2 [offline, not found, bad]', KIND_TROUBLE),
+}
+
+# maps the type of an event pushed over the websocket to its (description, kind);
+# there is no subtype, so read_event() also checks the code and site
+_WS_EVENT_DESC = {
+    1: ('Card Found', KIND_CARD_FOUND),
+    2: ('Card Not Found', KIND_CARD_NOT_FOUND),
+    5: ('Timezone Violation', KIND_TIMEZONE),
+    12: ('VIP Card Found', KIND_VIP_CARD_FOUND),
+    11: ('Card Not Found: expired', KIND_CARD_NOT_FOUND),
+}
+
+# the filters the webapp posts to getEvents.lsp for panel events (t=2) and web
+# events (t=4), returning up to l events starting at offset o
+_EVENTS_FILTER = '{"t":2,"a":[],"b":[],"c":"0","d":"","e":[],"f":[],"l":%d,"o":%d,"s":0}'
+_WEB_EVENTS_FILTER = '{"t":4,"a":[],"b":[],"c":0,"d":"","e":[],"f":[],"l":0,"o":%d,"s":0}'
+_WEB_EVENTS_FILTER_0 = _WEB_EVENTS_FILTER % 0
+
+# we fetch at most this many panel events per scrape, in pages sized from
+# how many events the previous scrape saw
+MAX_EVENTS, MIN_EVENTS_PAGE = 200, 16
+
+
+class Card:
+    """An access card. We keep one per card in the system, so use slots. Zero
+    for expiration or last_swiped means never; None for uses_remaining means
+    unlimited."""
+    __slots__ = ('card', 'lastname', 'firstname', 'pin', 'note1', 'note2', 'type',
+                 'access', 'activation', 'expiration', 'uses_remaining', 'last_swiped')
+
+    def __init__(self, card, lastname='', firstname='', pin='', note1='', note2='',
+                 type='', access='', activation=0, expiration=0, uses_remaining=None,
+                 last_swiped=0):
+        self.card, self.lastname, self.firstname, self.pin = card, lastname, firstname, pin
+        self.note1, self.note2, self.type, self.access = note1, note2, type, access
+        self.activation, self.expiration = activation, expiration
+        self.uses_remaining, self.last_swiped = uses_remaining, last_swiped
+
+    def copy(self):
+        return Card(*[getattr(self, k) for k in self.__slots__])
+
+    def __repr__(self):
+        return 'Card(' + ', '.join(f'{k}={getattr(self, k)!r}' for k in self.__slots__) + ')'
+
+
+_EPOCH = datetime(1970, 1, 1)
+
+# login.lsp statuscode => what went wrong
+_LOGIN_ERRORS = {
+    '1': 'username %s not found',
+    '2': 'incorrect password for username %s',
+    '3': 'expired password for username %s',
+    '4': 'retry limit exceeded for username %s',
+    '5': 'system error for username %s',
+    '6': 'username %s is locked out',
+    '7': 'username %s is disabled',
+}
+
+# lowercased web event type => the last_porter counter it bumps (logins
+# only count if they are by an administrator)
+_WEB_EVENT_COUNTERS = {
+    'invalid password': 'invalidpasswords',
+    'unknown user': 'invalidpasswords',
+    'login': 'adminlogins',
+    'logout': None,
+}
+
+# what get_events() and the websocket hand to NetaxsClient; site is only
+# known for events from the websocket
+Event = namedtuple('Event', 'id when panel reader logical physical description kind code name site', defaults=('',))
+WebEvent = namedtuple('WebEvent', 'when type description notes')
+
+# The panel only ever sends us these two formats, so we parse them by hand
+# rather than have strptime() interpret its format string for every row.
+
+def _parse_mdy(s):
+    """Parses e.g. '7/19/2021' into a naive datetime."""
+    (month, day, year) = s.split('/')
+    return datetime(int(year), int(month), int(day))
+
+def _parse_mdy_hms(s):
+    """Parses e.g. ' 7/19/2021 09:32:49' into a naive datetime."""
+    (date, hms) = s.split()
+    (month, day, year) = date.split('/')
+    (hour, minute, second) = hms.split(':')
+    return datetime(int(year), int(month), int(day), int(hour), int(minute), int(second))
+
+
 class Session:
     def __init__(self, uri, user, password, timeout, verify=None, timezone=''):
         """The password must have already been hashed according to the NetAXS algorithm."""
         self.uri, self.user, self.password = uri, user, password
         self.timeout, self.verify = timeout, verify
-        self.timezone = pytz.timezone(timezone) if timezone else None
-        self.session = None
-        if self.uri.find('://') == -1:
+        self.timezone = ZoneInfo(timezone) if timezone else None
+        self._day_offsets = {} # see _timestamp()
+        self._date_timestamps = {} # see _date_timestamp()
+        # We keep one requests session, and its connection pool, for as long
+        # as we live; logging in again just replaces its cookies and headers.
+        # We make several requests to the same panel on every scrape, so keep
+        # the connections alive and retry the ones that fail to connect. If a
+        # 5xx persists, hand back the last response so raise_for_status()
+        # raises HTTPError (which our callers handle) rather than RetryError.
+        self.session = requests.Session()
+        self.session.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=4,
+                              max_retries=Retry(total=3, backoff_factor=0.3,
+                                                status_forcelist=[502, 503, 504],
+                                                raise_on_status=False))
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.session.hooks['response'].append(self._track_xsrf)
+        self.logged_in = False
+        if '://' not in self.uri:
             self.uri = f'https://{self.uri}'
-        while self.uri.endswith('/'):
-            self.uri = self.uri[:len(self.uri)-1]
-        self.cv = threading.Condition()
+        self.uri = self.uri.rstrip('/')
+        self.cv = threading.Lock()
         self.failed_fetches = 0
         self._cards_readahead = None
+        # The card report rarely changes between fetches, so we remember what
+        # each row parsed to (and the report's ETag, if the panel sends one).
+        self._cards_etag = None
+        self._parsed_card_rows = {}
+        self.events_page_size = MAX_EVENTS
         self.has_ended = False
         self.request_reopen = False
+        self.metrics = None # only kept up to date if refresh_interval is set
 
     def open(self):
-        if self.session:
+        """Logs in, unless we are already logged in."""
+        if self.logged_in:
             return
         assert not self.has_ended  # should be no references to us if we've ended
-        LOGGER.info(f'opening connection to {self.uri}')
+        LOGGER.info(f'logging in to {self.uri}')
         LOGIN_ATTEMPTS.labels(uri=self.uri).inc()
         self.failed_fetches = 0
-        self.session = requests.Session()
-        self.session.verify = self.verify
+        self.session.cookies.clear()
+        self.session.headers.pop('X-XSRF-TOKEN', None)
 
         authinfo = { 'user': self.user, 'pwd': self.password }
         p = self.session.post(f'{self.uri}/lib/login.lsp', data=authinfo, timeout=self.timeout)
         p.raise_for_status()
         self._debug('duringlogin', p)
-        r = p.json()
-        statuscode = r['statuscode']
-        if statuscode == '1':
-            raise NetaxsError(f'username {r["username"]} not found')
-        elif statuscode == '2':
-            raise NetaxsError(f'incorrect password for username {r["username"]}')
-        elif statuscode == '3':
-            raise NetaxsError(f'expired password for username {r["username"]}')
-        elif statuscode == '4':
-            raise NetaxsError(f'retry limit exceeded for username {r["username"]}')
-        elif statuscode == '5':
-            raise NetaxsError(f'system error for username {r["username"]}')
-        elif statuscode == '6':
-            raise NetaxsError(f'username {r["username"]} is locked out')
-        elif statuscode == '7':
-            raise NetaxsError(f'username {r["username"]} is disabled')
+        r = _loads(p.content)
+        error = _LOGIN_ERRORS.get(r['statuscode'])
+        if error:
+            raise NetaxsError(error % r['username'])
 
         # the next post sets the actual signed-in cookies and/or sets the
         # application state to "signed in"
@@ -90,25 +222,50 @@ class Session:
         pp.raise_for_status()
         self._debug('afterlogin', pp)
         self._cards_readahead = None
-  
+        # every request after login needs these, and they don't change until
+        # we log in again
+        self.session.headers.update({
+            'Referer': f'{self.uri}/views/home/index.lsp',
+            'X-XSRF-TOKEN': self.session.cookies['XSRF-TOKEN']
+        })
+        self.logged_in = True
+
+    def _track_xsrf(self, r, *args, **kwargs):
+        """Response hook. open() sets the X-XSRF-TOKEN header once, but if the
+        panel hands us a new XSRF-TOKEN cookie later, send that one instead."""
+        token = r.cookies.get('XSRF-TOKEN')
+        if token and self.logged_in:
+            self.session.headers['X-XSRF-TOKEN'] = token
+
+    def relogin(self):
+        """Logs in again, keeping our pooled connections."""
+        self.logged_in = False
+        self._cards_readahead = None
+        self.open()
+
+    def _ensure_logged_in(self):
+        if not self.logged_in:
+            self.open()
+
     def close(self):
+        """Forgets our login and closes our pooled connections."""
         LOGGER.info(f'closing connection to {self.uri}')
         self.session.close()
-        self.session = None
+        self.logged_in = False
         self._cards_readahead = None
 
-    def get_events(self, panel=1, start=0, notbefore=0):
-        self._set_headers()
+    def get_events(self, panel=1, start=0, notbefore=0, count=MAX_EVENTS):
         assert panel == 1, f'other panels not supported {panel}'
+        self._ensure_logged_in()
         postdata = {
-            'filter': """{"t":2,"a":[],"b":[],"c":"0","d":"","e":[],"f":[],"l":200,"o":%d,"s":0}""" % start
+            'filter': _EVENTS_FILTER % (count, start)
         }
         events = self.session.post(f'{self.uri}/models/events/getEvents.lsp', data=postdata, timeout=self.timeout)
         events.raise_for_status()
         self._debug('events', events)
 
         out = []
-        js = events.json()
+        js = _loads(events.content)
         # get assigned doors: [1,1,1,"Door1.1",1]
         # door I/O mapping: [1,1,0,1,1,2,3,4,2,1,5]
         # 1," 7\/19\/2021 09:32:49 ",4531,"Input 20: PANEL TAMPER",0,20,0,2,"0",0,"",        0,1
@@ -120,98 +277,53 @@ class Session:
                 typeint, subtypeint = int(evtype), int(evsubtype)
             except ValueError:
                 typeint, subtypeint = -1, -1
-            if typeint == 1:
-                if subtypeint == 0:
-                    if int(code) == 0:
-                        desc = 'online'
-                    else:
-                        desc = 'Card Found'
-                elif subtypeint == 2:
-                    desc = 'common database update'
-                elif subtypeint == 3:
-                    desc = 'panel database update [post-upgrade]'
-                else:
-                    desc = f'unknown type 1 [good, found, success] subtype {evsubtype}'
-            elif typeint == 2:
-                if subtypeint == 0:
-                    desc = 'EVL controller offline'
-                elif subtypeint == 1:
-                    if int(space) == 1:
-                        desc = 'TAMPER'
-                    else:
-                        desc = 'Card Not Found'
-                elif subtypeint == 2:
-                    desc = 'panel database update [type 2]'
-                else:
-                    desc = f'unknown type 2 [offline, not found, bad] subtype {evsubtype}'
-            elif typeint == 12 and subtypeint == 0:
-                desc = 'VIP Card Found'
-            elif typeint == 11 and subtypeint == 1:
-                desc = 'Card Not Found: expired'
-            elif typeint == 142 and subtypeint == 0:
-                desc = 'firmware update in progress'
-            elif typeint == 130 and subtypeint == 1:
-                desc = 'panel restarted' # firmware revision in reader field
-            elif typeint == 5 and subtypeint == 1:
-                desc = 'timezone violation'
-            else:
-                desc = f'unknown type {evtype} subtype {evsubtype}'
-            ts = self._localize(datetime(year=timedict['year'], month=timedict['month'], day=timedict['day'], hour=timedict['hour'], minute=timedict['min'], second=timedict['sec'])).timestamp()
+            (desc, kind) = _EVENT_DESC.get((typeint, subtypeint), (None, KIND_UNKNOWN))
+            if desc is None:
+                (prefix, kind) = _UNKNOWN_EVENT_PREFIX.get(typeint, (f'unknown type {evtype}', KIND_UNKNOWN))
+                desc = f'{prefix} subtype {evsubtype}'
+            elif typeint == 1 and subtypeint == 0 and int(code) == 0:
+                (desc, kind) = ('online', KIND_ONLINE)
+            elif typeint == 2 and subtypeint == 1 and int(space) == 1:
+                (desc, kind) = ('TAMPER', KIND_TROUBLE)
+            ts = self._timestamp(datetime(year=timedict['year'], month=timedict['month'], day=timedict['day'], hour=timedict['hour'], minute=timedict['min'], second=timedict['sec']))
             if ts < notbefore:
                 break
-            out.append({
-                'id': int(evid),
-                'when': ts,
-                'panel': panel,
-                'reader': device,
-                'logical': int(logical),
-                'physical': int(physical),
-                'description': desc,
-                'code': code,
-                'name': lastname,
-            })
+            out.append(Event(int(evid), ts, panel, device, int(logical), int(physical), desc, kind, code, lastname))
         return out
 
     def get_web_events(self, panel=1, start=0, notbefore=0):
-        self._set_headers()
         assert panel == 1, f'other panels not supported {panel}'
-        data = { 'filter':
-                 """{"t":4,"a":[],"b":[],"c":0,"d":"","e":[],"f":[],"l":0,"o":%d,"s":0}""" % start
-        }
+        self._ensure_logged_in()
+        data = { 'filter': _WEB_EVENTS_FILTER % start if start else _WEB_EVENTS_FILTER_0 }
         p = self.session.post(f'{self.uri}/models/events/getEvents.lsp', data=data, timeout=self.timeout)
         self._debug('prewebevents', p)
         p.raise_for_status()
-        r = p.json()
+        r = _loads(p.content)
         statuscode = r[0]
         if int(statuscode) != 0:
             raise NetaxsError(f'get_web_events got error status {r}')
 
-        self._set_headers()
-        events = self.session.get(f'{self.uri}/models/WebEvents.csv', timeout=self.timeout)
-        self._debug('webevents', events)
-        events.raise_for_status()
-
-        out = []
-        for line in events.text.split('\n')[1:]: # first line is a header
-            if not line:
-                continue # ignore empty lines, such as at EOF
-            values = line.strip().split(',') # CSV
-            if len(values) == 3:
-                (when, event_type, desc) = values
-                notes = ''
-            else:
-                (when, event_type, desc, notes) = values
-            ts = self._localize(datetime.strptime(
-                when.strip(), '%m/%d/%Y %H:%M:%S')).timestamp()
-            if ts < notbefore:
-                break
-            out.append({
-                'notes': notes,
-                'type': event_type,
-                'description': desc,
-                'when': ts,
-            })
-        return out
+        events = self.session.get(f'{self.uri}/models/WebEvents.csv', timeout=self.timeout, stream=True)
+        try:
+            self._debug('webevents', events)
+            events.raise_for_status()
+
+            out = []
+            for values in self._csv_rows(events):
+                if not values:
+                    continue # ignore empty lines, such as at EOF
+                if len(values) == 3:
+                    (when, event_type, desc) = values
+                    notes = ''
+                else:
+                    (when, event_type, desc, notes) = values
+                ts = self._timestamp(_parse_mdy_hms(when))
+                if ts < notbefore:
+                    break
+                out.append(WebEvent(ts, event_type, desc, notes))
+            return out
+        finally:
+            events.close()
 
     def get_cards(self):
         if self._cards_readahead:
@@ -220,7 +332,7 @@ class Session:
             self._cards_readahead = None
             return cards
         LOGGER.debug(f'{self.uri} fetching cards from server')
-        self._set_headers()
+        self._ensure_logged_in()
         data = {
             'panelnum': 1,
             'type': 1,
@@ -231,99 +343,137 @@ class Session:
         p = self.session.post(f'{self.uri}/models/where/upload/processFile.lsp', data=data, timeout=self.timeout)
         p.raise_for_status()
         self._debug('precards', p)
-        r = p.json()
+        r = _loads(p.content)
         statuscode = r['status']
         if int(statuscode) == 9:
             pass
         elif int(statuscode) != 0 or r['failedPanels']:
             raise NetaxsError(f'error status during get_cards phase 1: {r}')
 
-        self._set_headers()
-        cards = self.session.get(f'{self.uri}/models/CardReport.csv', timeout=self.timeout)
-        if cards.status_code == 404:
-            self.failed_fetches += 1
-            if self.failed_fetches > 3:
-                LOGGER.error(f'{self.failed_fetches} consecutive failed fetches; reconnecting')
-                self.close()
-                self.open()
-        cards.raise_for_status()
-        LOGGER.debug(f'{self.uri} successfully fetched cards from server')
-        self.failed_fetches = 0
-        self._debug('cards', cards)
-
-        out = []
-        for line in cards.text.split('\n')[1:]: # first line is a header
-            if not line:
-                continue # ignore empty lines, such as at EOF
-            (card, lastname, firstname, trace_enabled, card_type, uses_remaining, expiration_date, access_levels, site_code, pin, info1, info2, timezones, activation_date, issue_level, apb_state, control_device, access_group, last_swiped_time, remainder) = line.strip().split(',') # CSV
-            d = {
-                'card': int(card),
-                'lastname': lastname,
-                'firstname': firstname,
-                'pin': pin, # not coverted to int since this is often empty
-                'note1': info2,
-                'note2': info1, # this is backwards, but info1 seems always empty in V6
-                'type': card_type,
-                'access': access_group.strip(';'),
-                'activation': self._localize(datetime.strptime(
-                    activation_date, '%m/%d/%Y')).timestamp(),
-            }
-            if uses_remaining:
-                d['uses_remaining'] = int(uses_remaining)
-            if expiration_date:
-                d['expiration'] = self._localize(datetime.strptime(
-                    expiration_date, '%m/%d/%Y')).timestamp()
-            if last_swiped_time:
-                d['last_swiped'] = self._localize(datetime.strptime(
-                    last_swiped_time, '%m/%d/%Y %H:%M:%S')).timestamp()
-            out.append(d)
-        return out
+        headers = { 'If-None-Match': self._cards_etag } if self._cards_etag else None
+        cards = self.session.get(f'{self.uri}/models/CardReport.csv', timeout=self.timeout, stream=True, headers=headers)
+        try:
+            if cards.status_code == 304:
+                LOGGER.debug(f'{self.uri} cards are unchanged')
+                self.failed_fetches = 0
+                return [c.copy() for c in self._parsed_card_rows.values()]
+            if cards.status_code == 404:
+                self.failed_fetches += 1
+                if self.failed_fetches > 3:
+                    LOGGER.error(f'{self.failed_fetches} consecutive failed fetches; logging in again')
+                    self.relogin()
+            cards.raise_for_status()
+            LOGGER.debug(f'{self.uri} successfully fetched cards from server')
+            self.failed_fetches = 0
+            self._debug('cards', cards)
+
+            out = []
+            previous, parsed = self._parsed_card_rows, {}
+            for row in self._csv_rows(cards):
+                if not row:
+                    continue # ignore empty lines, such as at EOF
+                key = tuple(row)
+                c = previous.get(key)
+                if c:
+                    # callers may update the cards we return, so hand out a copy
+                    parsed[key] = c
+                    out.append(c.copy())
+                    continue
+                (card, lastname, firstname, trace_enabled, card_type, uses_remaining, expiration_date, access_levels, site_code, pin, info1, info2, timezones, activation_date, issue_level, apb_state, control_device, access_group, last_swiped_time, remainder) = row
+                c = Card(int(card), lastname=lastname, firstname=firstname,
+                         pin=pin, # not coverted to int since this is often empty
+                         note1=info2,
+                         note2=info1, # this is backwards, but info1 seems always empty in V6
+                         type=card_type,
+                         access=access_group.strip(';'),
+                         activation=self._date_timestamp(activation_date))
+                if uses_remaining:
+                    c.uses_remaining = int(uses_remaining)
+                if expiration_date:
+                    c.expiration = self._date_timestamp(expiration_date)
+                if last_swiped_time:
+                    c.last_swiped = self._timestamp(_parse_mdy_hms(last_swiped_time))
+                parsed[key] = c
+                out.append(c.copy())
+            self._parsed_card_rows = parsed
+            self._cards_etag = cards.headers.get('ETag')
+            return out
+        finally:
+            cards.close()
 
     def get_badges(self):
         """In V6, operator does not have permission to do this."""
-        self._set_headers()
+        self._ensure_logged_in()
         badges = self.session.post(f'{self.uri}/models/who/badge/getbadges.lsp', timeout=self.timeout)
         badges.raise_for_status()
         self._debug('badges', badges)
 
         out = []
-        for (card, pin, note, use_limited, uses_remaining, card_type, has_expiration, expiresMonth, expiresDay, expiresYear, firstname, lastname, trace_enabled, activatedMonth, activatedDay, activatedYear, is_expired) in zip(*([iter(badges.json())]*17)):
-            d = {
-                'card': int(card),
-                'lastname': lastname,
-                'firstname': firstname,
-                'pin': pin, # not coverted to int since this is often empty
-                'note1': note,
-                'activation': self._localize(datetime(year=int(activatedYear), month=int(activatedMonth), day=int(activatedDay))).timestamp(),
-                'access': '' if is_expired else 'not expired',
-            }
+        for (card, pin, note, use_limited, uses_remaining, card_type, has_expiration, expiresMonth, expiresDay, expiresYear, firstname, lastname, trace_enabled, activatedMonth, activatedDay, activatedYear, is_expired) in zip(*([iter(_loads(badges.content))]*17)):
+            c = Card(int(card), lastname=lastname, firstname=firstname,
+                     pin=pin, # not coverted to int since this is often empty
+                     note1=note,
+                     activation=self._timestamp(datetime(year=int(activatedYear), month=int(activatedMonth), day=int(activatedDay))),
+                     access='' if is_expired else 'not expired')
             if use_limited:
-                d['uses_remaining'] = int(uses_remaining)
+                c.uses_remaining = int(uses_remaining)
             if card_type == 2:
-                d['type'] = 'employee'
+                c.type = 'employee'
             elif card_type == 1:
-                d['type'] = 'VIP'
+                c.type = 'VIP'
             elif card_type == 0:
-                d['type'] = 'supervisor'
+                c.type = 'supervisor'
             else:
-                d['type'] = f'unknown card type {card_type}'
+                c.type = f'unknown card type {card_type}'
             if has_expiration:
-                d['expiration'] = self._localize(datetime(year=int(expiresYear), month=int(expiresMonth), day=int(expiresDay))).timestamp()
-            out.append(d)
+                c.expiration = self._timestamp(datetime(year=int(expiresYear), month=int(expiresMonth), day=int(expiresDay)))
+            out.append(c)
         return out
     
-    def _set_headers(self):
-        self.session.headers.update({
-            'Referer': f'{self.uri}/views/home/index.lsp',
-            'X-XSRF-TOKEN': self.session.cookies['XSRF-TOKEN']
-        })
+    def _csv_rows(self, resp):
+        """Returns a csv.reader over a streamed response, skipping the header.
+        We parse the rows as they arrive rather than holding the whole body."""
+        if resp.encoding is None:
+            resp.encoding = 'utf-8'
+        rows = csv.reader(resp.iter_lines(decode_unicode=True))
+        next(rows, None) # first line is a header
+        return rows
+
+    def _timestamp(self, dtime):
+        """Returns the POSIX timestamp of the naive datetime dtime, which is in
+        self.timezone (or local time if self.timezone is None). The UTC offset
+        is the same all day except on DST transition days, so we cache it by
+        day and only localize dtime on those days."""
+        if self.timezone is None:
+            return dtime.timestamp()
+        day = dtime.toordinal()
+        offset = self._day_offsets.get(day)
+        if offset is None:
+            midnight = datetime.fromordinal(day)
+            offset = self.timezone.utcoffset(midnight)
+            if offset != self.timezone.utcoffset(midnight + timedelta(days=1)):
+                offset = False # a transition day
+            else:
+                offset = offset.total_seconds()
+            self._day_offsets[day] = offset
+        if offset is False:
+            return self._localize(dtime).timestamp()
+        return (dtime - _EPOCH).total_seconds() - offset
+
+    def _date_timestamp(self, mdy):
+        """Returns the timestamp of midnight on the date mdy, e.g. '7/19/2021'.
+        Card reports repeat a few activation and expiration dates many times."""
+        ts = self._date_timestamps.get(mdy)
+        if ts is None:
+            ts = self._date_timestamps[mdy] = self._timestamp(_parse_mdy(mdy))
+        return ts
 
     def _localize(self, dtime):
         """Accepts a naive datetime dtime, in the timezone of self.timezone, and returns
         an aware datetime in that same timezone. If self.timezone is None, just returns
-        dtime unchanged. Raises pytz.exceptions.AmbiguousTimeError if dtime is
-        ambiguous (during a Daylight Savings transition window)."""
-        return self.timezone.localize(dtime) if self.timezone else dtime
+        dtime unchanged. During the repeated hour at the end of Daylight Savings,
+        dtime is taken to be the first (DST) occurrence."""
+        return dtime.replace(tzinfo=self.timezone) if self.timezone else dtime
 
     def _debug(self, where, response):
         """during debugging, this method writes request/response info"""
@@ -340,7 +490,7 @@ class NetaxsClient:
     def __init__(self, config, eventbus):
         self.config = config
         self.eventbus = eventbus
-        self.cv = threading.Condition()
+        self.cv = threading.Lock()
         self.targetmap = {}
         self.targeteventbusmap = {}
         self.awaitables = set()
@@ -356,11 +506,20 @@ class NetaxsClient:
             myconfig['timeout'] = 40
         if not myconfig.get('card_refetch_interval'):
             myconfig['card_refetch_interval'] = 0
-
-    def _increment(self, d, key, increment=1):
-        newv = d.get(key, 0) + increment
-        d[key] = newv
-        return newv
+        if not myconfig.get('refresh_interval'):
+            myconfig['refresh_interval'] = 0
+
+        # maps the kind of each event to its handler
+        self._event_handlers = {
+            KIND_CARD_FOUND: self._on_card_found,
+            KIND_VIP_CARD_FOUND: self._on_card_found,
+            KIND_CARD_NOT_FOUND: self._on_card_not_found,
+            KIND_TIMEZONE: self._on_timezone_violation,
+            KIND_DATABASE_UPDATE: self._on_database_update,
+            KIND_ONLINE: self._on_online,
+            KIND_TROUBLE: self._on_trouble,
+            KIND_UNKNOWN: self._on_unknown_event,
+        }
 
     def _get_session(self, target):
         """must hold self.cv upon call"""
@@ -398,28 +557,35 @@ class NetaxsClient:
             s = Session(target, user, password, timeout, verify=verify, timezone=timezone)
             s.open()
             s.last_porter = {
-                'adminlogins': 0, 'invalidpasswords': 0, 'dbupdates': {},
-                'cardnotfound': {}, 'timezone': {}, 'cardfound': {}, 'card_timestamp': 0,
+                'adminlogins': 0, 'invalidpasswords': 0, 'dbupdates': defaultdict(int),
+                'cardnotfound': defaultdict(int), 'timezone': defaultdict(int),
+                'rejected': defaultdict(int), # cardnotfound + timezone
+                'cardfound': {}, 'card_timestamp': 0,
                 'unknowneventtypes': 0, 'tamper': 0,
                 'eventid': 0, 'timestamp': self.starttime - 5,
                 'successful_io_timestamp': 0,
             }
             s.last_porter['dbupdates']['0/0'] = 0
             for vip in [True, False]:
-                s.last_porter['cardfound'][vip] = {}
+                s.last_porter['cardfound'][vip] = defaultdict(int)
                 for lnpn in self.known_lnpns:
                     s.last_porter['cardfound'][vip][lnpn] = 0
                     s.last_porter['cardnotfound'][lnpn] = 0
                     s.last_porter['timezone'][lnpn] = 0
+                    s.last_porter['rejected'][lnpn] = 0
             ws = Websocket(self, s)
             #### this fails because there is no running event loop in this thread
             #### self.awaitables.add(asyncio.create_task(ws._coro_for_session()))
             self.awaitables.add(ws._coro_for_session())
             self.targetmap[target] = s
             self.targeteventbusmap[s.uri] = self.eventbus.target(target)
+            if self.config['netaxs']['refresh_interval']:
+                threading.Thread(target=self._refresh_loop, args=(target, s),
+                                 name=f'netaxs {target}', daemon=True).start()
         return s
 
     def _retry_if_needed(self, session, func, tries=3):
+        relogged_in = False
         while True:
             try:
                 return func()
@@ -428,11 +594,17 @@ class NetaxsClient:
                 LOGGER.info(f'retrying fetch {session.uri} due to {e} in {func}')
                 tries -= 1
                 if tries == -1:  # FIXME disabled for now
-                    LOGGER.info(f'closing session {session.uri} due to {e} in {func}')
-                    session.close()
-                    session.open()
+                    LOGGER.info(f'logging in again to {session.uri} due to {e} in {func}')
+                    session.relogin()
                 if tries == 0:
                     raise
+            except requests.exceptions.HTTPError as e:
+                # our login has lapsed; log in again, but only once
+                if relogged_in or e.response is None or e.response.status_code not in (401, 403):
+                    raise
+                LOGGER.info(f'logging in again to {session.uri} due to {e} in {func}')
+                relogged_in = True
+                session.relogin()
 
     async def poll(self):
         """Awaits events from each active Session. When one comes in, we update
@@ -440,205 +612,257 @@ class NetaxsClient:
         """
         poller = AsyncPollingLoop('netaxs')
         while True:
+            # Only swap out the new awaitables under the lock. Starting a task
+            # may run it right away (eager tasks), and it may need the lock.
             with self.cv:
                 for eventbus in self.targeteventbusmap.values():
                     eventbus.add_awaitables_to(self.awaitables)
-                for awaitable in self.awaitables:
-                    poller.add_awaitable(awaitable)
-                self.awaitables = set()
+                (awaitables, self.awaitables) = (self.awaitables, set())
+            for awaitable in awaitables:
+                poller.add_awaitable(awaitable)
+            # New sessions and eventbus reactions are added by other threads,
+            # which can't wake us, so the poller still times out periodically.
             await poller.wait()
 
     def _update_cards(self, session, now):
         last = session.last_porter
         cards = self._retry_if_needed(session, lambda: session.get_cards())
-        last['cards'] = { c['card']: c for c in cards }
+        last['cards'] = { c.card: c for c in cards }
         last['card_timestamp'] = now
 
     def _update_one_event(self, session, d):
-        def getit(d, sub):
-            r = d.get(sub)
-            if r is None:
-                r = {}
-                d[sub] = r
-            return r
         last = session.last_porter
-        cards = last.get('cards')
-        if not cards:
-            cards = {}
-            last['cards'] = cards
-        eventid = d['id']
-        last['eventid'] = max(last['eventid'], eventid)
-        low = d['description'].lower()
-        lp = f"{d.get('logical', '')}/{d.get('physical', '')}"
-        plp = f"{d.get('panel', '')}/{lp}"
+        if not last.get('cards'):
+            last['cards'] = {}
+        last['eventid'] = max(last['eventid'], d.id)
+        lp = f'{d.logical}/{d.physical}'
+        plp = f'{d.panel}/{lp}'
         eventbus = self.targeteventbusmap[session.uri]
-        if 'card found' in low:
-            eventbus.propagate((d['name'], d['description'], plp))
-            m = getit(last['cardfound'], 'vip' in low)
-            self._increment(m, lp)
-            codeint = int(d['code'])
-            card = last.get('cards', {}).get(codeint)
-            vip = ' VIP' if 'vip' in low else ''
-            if card:
-                LOGGER.info(f'{session.uri}{vip} {d["name"]} swiped {time.ctime(d["when"])}, previous {time.ctime(card["last_swiped"])}')
-                card['last_swiped'] = d['when']
-            else:
-                LOGGER.info(f'{session.uri}{vip} new card {d["name"]} swiped {time.ctime(d["when"])}')
-                last['cards'][codeint] = {
-                    'card': int(d['code']),
-                    'lastname': d.get('lastname', '(none)'),
-                }
-        elif 'card not found' in low: # either not found or expired
-            eventbus.propagate((d.get('name', ''), d['description'], plp))
-            self._increment(last['cardnotfound'], lp)
-            LOGGER.info(f'{session.uri} {d.get("name", "")} {d["description"]}')
-        elif 'timezone violation' in low:
-            eventbus.propagate((d['name'], d['description'], plp))
-            self._increment(last['timezone'], lp)
-            LOGGER.info(f'{session.uri} {d["name"]} timezone violation {time.ctime(d["when"])}')
-            # TODO: should we update last_swiped?
-        elif 'database update' in low:
-            eventbus.propagate(('', d['description'], plp))
-            LOGGER.warning(f'{session.uri} {low} {d}')
-            self._increment(last['dbupdate'], lp)
-        elif 'online' in low:
-            eventbus.propagate(('', d['description'], plp))
-            LOGGER.info(f'{session.uri} {low} {d}')
-        elif 'tamper' in low or 'offline' in low or 'restarted' in low:
-            eventbus.propagate(('', d['description'], plp))
-            LOGGER.warning(f'{session.uri} {low}: {d}')
-            self._increment(last, 'tamper')
+        handler = self._event_handlers.get(d.kind, self._on_unknown_event)
+        handler(session, last, d, lp, plp, eventbus)
+        last['timestamp'] = max(d.when, last['timestamp'])
+
+    def _on_card_found(self, session, last, d, lp, plp, eventbus):
+        eventbus.propagate((d.name, d.description, plp))
+        is_vip = d.kind == KIND_VIP_CARD_FOUND
+        last['cardfound'][is_vip][lp] += 1
+        codeint = int(d.code)
+        card = last['cards'].get(codeint)
+        vip = ' VIP' if is_vip else ''
+        if card:
+            LOGGER.info(f'{session.uri}{vip} {d.name} swiped {time.ctime(d.when)}, previous {time.ctime(card.last_swiped)}')
+            card.last_swiped = d.when
         else:
-            eventbus.propagate(('', d['description'], plp))
-            LOGGER.warning(f'{session.uri} [unknown event type] {low} {d}')
-            self._increment(last, 'unknowneventtypes')
-        last['timestamp'] = max(d['when'], last['timestamp'])
+            LOGGER.info(f'{session.uri}{vip} new card {d.name} swiped {time.ctime(d.when)}')
+            last['cards'][codeint] = Card(codeint, lastname=d.name or '(none)')
+
+    def _on_card_not_found(self, session, last, d, lp, plp, eventbus):
+        # either not found or expired
+        eventbus.propagate((d.name, d.description, plp))
+        last['cardnotfound'][lp] += 1
+        last['rejected'][lp] += 1
+        LOGGER.info(f'{session.uri} {d.name} {d.description}')
+
+    def _on_timezone_violation(self, session, last, d, lp, plp, eventbus):
+        eventbus.propagate((d.name, d.description, plp))
+        last['timezone'][lp] += 1
+        last['rejected'][lp] += 1
+        LOGGER.info(f'{session.uri} {d.name} timezone violation {time.ctime(d.when)}')
+        # TODO: should we update last_swiped?
+
+    def _on_database_update(self, session, last, d, lp, plp, eventbus):
+        eventbus.propagate(('', d.description, plp))
+        LOGGER.warning(f'{session.uri} {d.description.lower()} {d}')
+        last['dbupdates'][lp] += 1
+
+    def _on_online(self, session, last, d, lp, plp, eventbus):
+        eventbus.propagate(('', d.description, plp))
+        LOGGER.info(f'{session.uri} {d.description.lower()} {d}')
+
+    def _on_trouble(self, session, last, d, lp, plp, eventbus):
+        # tamper, controller offline, or panel restarted
+        eventbus.propagate(('', d.description, plp))
+        LOGGER.warning(f'{session.uri} {d.description.lower()}: {d}')
+        last['tamper'] += 1
+
+    def _on_unknown_event(self, session, last, d, lp, plp, eventbus):
+        eventbus.propagate(('', d.description, plp))
+        LOGGER.warning(f'{session.uri} [unknown event type] {d.description.lower()} {d}')
+        last['unknowneventtypes'] += 1
+
+    def _fetch_events(self, session, notbefore):
+        """Returns up to MAX_EVENTS events no older than notbefore, newest
+        first. Most scrapes see only a few new events, so we ask for a small
+        page and only fetch another if that one came back full.
+        """
+        size = session.events_page_size
+        events = session.get_events(notbefore=notbefore, count=size)
+        full = len(events) == size
+        while full and len(events) < MAX_EVENTS:
+            count = min(size, MAX_EVENTS - len(events))
+            page = session.get_events(start=len(events), notbefore=notbefore, count=count)
+            full = len(page) == count
+            # events that arrived since the last page shift the offsets
+            oldest = events[-1].id
+            page = [e for e in page if e.id < oldest]
+            if not page:
+                break
+            events += page
+        session.events_page_size = min(MAX_EVENTS, max(MIN_EVENTS_PAGE, 2*len(events)))
+        return events
 
     def _update_events(self, session):
         last = session.last_porter
         events = self._retry_if_needed(
-            session, lambda: session.get_events(notbefore=last['timestamp']))
+            session, lambda: self._fetch_events(session, last['timestamp']))
         maxcompletedeventid = last['eventid']
         for d in events:
-            if d['id'] <= maxcompletedeventid:
+            if d.id <= maxcompletedeventid:
                 break  # they come in decreasing order, so we are done
             self._update_one_event(session, d)
-        webevents = session.get_web_events(notbefore=last['timestamp'])
+        webevents = self._retry_if_needed(
+            session, lambda: session.get_web_events(notbefore=last['timestamp']))
         for d in webevents:
-            low = d['type'].lower()
-            if low == 'invalid password' or low == 'unknown user':
-                last['invalidpasswords'] += 1
-            elif low == 'login':
-                if 'Administrator' in d['description']:
-                    last['adminlogins'] += 1
-            elif low == 'logout':
-                pass
-            else:
-                LOGGER.info(f'{target}: unknown webevent type {low}: {d}')
-
-        # update timestamp with latest timestamp we got back
-        allevents = events + webevents
-        latest = max([e.get('when', 0) for e in allevents]) if allevents else 0
-        last['timestamp'] = max(latest, last['timestamp'])
+            low = d.type.lower()
+            try:
+                counter = _WEB_EVENT_COUNTERS[low]
+            except KeyError:
+                LOGGER.info(f'{session.uri}: unknown webevent type {low}: {d}')
+                continue
+            if counter == 'adminlogins' and 'Administrator' not in d.description:
+                continue
+            if counter:
+                last[counter] += 1
+
+        # update timestamp with latest timestamp we got back; both lists are
+        # newest first
+        if events:
+            last['timestamp'] = max(events[0].when, last['timestamp'])
+        if webevents:
+            last['timestamp'] = max(webevents[0].when, last['timestamp'])
 
     @REQUEST_TIME.time()
     def collect(self, target):
-        metric_to_gauge = {}
-        def makegauge(metric, desc, labels=[]):
-            already = metric_to_gauge.get(metric)
-            if already:
-                return already
-            gmf = GaugeMetricFamily(metric, desc, labels=labels)
-            metric_to_gauge[metric] = gmf
-            return gmf
-
         with self.cv:
             session = self._get_session(target)
+        if self.config['netaxs']['refresh_interval']:
+            # _refresh_loop() keeps these current, so don't wait on the panel
+            metrics = session.metrics
+            if metrics is not None:
+                return metrics
         with session.cv:
-            last = session.last_porter
             now = time.time()
-            if session.request_reopen:
-                session.request_reopen = False
+            self._refresh(target, session, now)
+            return self._make_metrics(session, now)
+
+    def _refresh_loop(self, target, session):
+        """Runs in its own thread when refresh_interval is configured, fetching
+        from the panel and rebuilding the session's metrics in the background."""
+        interval = self.config['netaxs']['refresh_interval']
+        while not session.has_ended:
+            try:
+                with session.cv:
+                    now = time.time()
+                    self._refresh(target, session, now)
+                    session.metrics = self._make_metrics(session, now)
+            except Exception as ex:
+                LOGGER.error(f'{target}: error refreshing in background', exc_info=ex)
+            time.sleep(interval)
+
+    def _refresh(self, target, session, now):
+        """must hold session.cv upon call"""
+        last = session.last_porter
+        if session.request_reopen:
+            session.request_reopen = False
+            session.relogin()
+        if now - last['card_timestamp'] > self.config['netaxs']['card_refetch_interval']:
+            LOGGER.debug(f'{target} updating cards and events')
+            try:
+                self._update_cards(session, now)
+            except requests.exceptions.ChunkedEncodingError:
+                # don't know why this happens, and it never seems to recover
+                del self.targetmap[target]
+                session.has_ended = True
                 session.close()
-                session.open()
-            if now - last['card_timestamp'] > self.config['netaxs']['card_refetch_interval']:
-                LOGGER.debug(f'{target} updating cards and events')
-                try:
-                    self._update_cards(session, now)
-                except requests.exceptions.ChunkedEncodingError:
-                    # don't know why this happens, and it never seems to recover
-                    del self.targetmap[target]
-                    session.has_ended = True
-                    session.close()
-                    raise
-                self._update_events(session)
-
-            gmf = makegauge('successful_io_timestamp', 'when last successful I/O occurred')
-            gmf.add_metric([], last['successful_io_timestamp']*1000)
-            numvalid = sum([1 for c in last['cards'].values() if c.get('uses_remaining', 1) > 0 and c.get('expiration', now+10) > now])
-            gmf = makegauge('num_access_cards', 'number of access cards in the system', ['valid'])
-            gmf.add_metric(['1'], numvalid)
-            gmf.add_metric(['0'], len(last['cards']) - numvalid)
-
-            gmf_swiped = makegauge('card_last_swiped', 'when access card was last swiped', ['firstname', 'lastname'])
-            gmf_expires = makegauge('card_expires', 'when access card expires', ['firstname', 'lastname'])
-            for d in last['cards'].values():
-                labels = [d.get('firstname', ''), d.get('lastname', '')]
-                swipetime = d.get('last_swiped', 0)
+                raise
+            self._update_events(session)
+
+    def _make_metrics(self, session, now):
+        """must hold session.cv upon call"""
+        last = session.last_porter
+        gmf_io = GaugeMetricFamily('successful_io_timestamp', 'when last successful I/O occurred', labels=[])
+        gmf_io.add_metric([], last['successful_io_timestamp']*1000)
+        # one sample per card per gauge, so skip add_metric() and append
+        # the samples ourselves, sharing one labels dict between them
+        gmf_swiped = GaugeMetricFamily('card_last_swiped', 'when access card was last swiped', labels=['firstname', 'lastname'])
+        gmf_expires = GaugeMetricFamily('card_expires', 'when access card expires', labels=['firstname', 'lastname'])
+        add_swiped, add_expires = gmf_swiped.samples.append, gmf_expires.samples.append
+        numvalid = 0
+        for c in last['cards'].values():
+            swipetime, expires, uses = c.last_swiped, c.expiration, c.uses_remaining
+            if (uses is None or uses > 0) and (not expires or expires > now):
+                numvalid += 1
+            if swipetime or expires:
+                labels = {'firstname': c.firstname, 'lastname': c.lastname}
                 if swipetime:
-                    gmf_swiped.add_metric(labels, swipetime)
-                expires = d.get('expiration', 0)
+                    add_swiped(Sample('card_last_swiped', labels, swipetime))
                 if expires:
-                    gmf_expires.add_metric(labels, expires)
-
-            gmf_invalid = makegauge('num_invalid_logins', 'how many invalid logins')
-            gmf_invalid.add_metric([], last['invalidpasswords'])
-            gmf_admin = makegauge('num_admin_logins', 'how many administrator logins')
-            gmf_invalid.add_metric([], last['adminlogins'])
-            # last['cardfound'] is keyed by is_vip and its value
-            # is a dictionary keyed by lnpn whose value is the count.
-            cmf_accepted = CounterMetricFamily(
-                'cards_accepted',
-                'number of card swipes that were accepted for access',
-                labels=['vip', 'lnpn'], created=self.starttime
-            )
-            for is_vip in [True, False]:
-                for (lnpn, count) in last['cardfound'].get(is_vip, {}).items():
-                    labels = ['1' if is_vip else '0', lnpn]
-                    cmf_accepted.add_metric(labels, count)
-
-            cmf_rejected = CounterMetricFamily(
-                'cards_rejected',
-                'number of card swipes that were rejected',
-                labels=['lnpn'], created=self.starttime
-            )
-            bad_lnpns = set(last['cardnotfound'].keys()).union(last['timezone'].keys())
-            for lnpn in bad_lnpns:
-                cmf_rejected.add_metric([lnpn], last['cardnotfound'].get(lnpn, 0) + last['timezone'].get(lnpn, 0))
-
-            cmf_dbupdates = CounterMetricFamily(
-                'num_database_updates',
-                'number of database updates performed',
-                labels=['lnpn'], created=self.starttime
-            )
-            for (lnpn, count) in last['dbupdates'].items():
-                cmf_dbupdates.add_metric([lnpn], count)
-
-            cmf_unknown = CounterMetricFamily(
-                'num_unknown_events',
-                'number of events with unknown eventtypes',
-                labels=[], created=self.starttime
-            )
-            cmf_unknown.add_metric([], last['unknowneventtypes'])
-
-            cmf_tamper = CounterMetricFamily(
-                'num_tamper_events',
-                'number of tamper events',
-                labels=[], created=self.starttime
-            )
-            cmf_tamper.add_metric([], last['tamper'])
-
-        return [g for g in metric_to_gauge.values()] + [cmf_accepted, cmf_rejected, cmf_dbupdates, cmf_unknown, cmf_tamper]
+                    add_expires(Sample('card_expires', labels, expires))
+        gmf_cards = GaugeMetricFamily('num_access_cards', 'number of access cards in the system', labels=['valid'])
+        gmf_cards.add_metric(['1'], numvalid)
+        gmf_cards.add_metric(['0'], len(last['cards']) - numvalid)
+
+        gmf_invalid = GaugeMetricFamily('num_invalid_logins', 'how many invalid logins', labels=[])
+        gmf_invalid.add_metric([], last['invalidpasswords'])
+        gmf_admin = GaugeMetricFamily('num_admin_logins', 'how many administrator logins', labels=[])
+        gmf_admin.add_metric([], last['adminlogins'])
+        # last['cardfound'] is keyed by is_vip and its value
+        # is a dictionary keyed by lnpn whose value is the count.
+        cmf_accepted = CounterMetricFamily(
+            'cards_accepted',
+            'number of card swipes that were accepted for access',
+            labels=['vip', 'lnpn'], created=self.starttime
+        )
+        for is_vip in [True, False]:
+            for (lnpn, count) in last['cardfound'].get(is_vip, {}).items():
+                labels = ['1' if is_vip else '0', lnpn]
+                cmf_accepted.add_metric(labels, count)
+
+        cmf_rejected = CounterMetricFamily(
+            'cards_rejected',
+            'number of card swipes that were rejected',
+            labels=['lnpn'], created=self.starttime
+        )
+        for (lnpn, count) in last['rejected'].items():
+            cmf_rejected.add_metric([lnpn], count)
+
+        cmf_dbupdates = CounterMetricFamily(
+            'num_database_updates',
+            'number of database updates performed',
+            labels=['lnpn'], created=self.starttime
+        )
+        for (lnpn, count) in last['dbupdates'].items():
+            cmf_dbupdates.add_metric([lnpn], count)
+
+        cmf_unknown = CounterMetricFamily(
+            'num_unknown_events',
+            'number of events with unknown eventtypes',
+            labels=[], created=self.starttime
+        )
+        cmf_unknown.add_metric([], last['unknowneventtypes'])
+
+        cmf_tamper = CounterMetricFamily(
+            'num_tamper_events',
+            'number of tamper events',
+            labels=[], created=self.starttime
+        )
+        cmf_tamper.add_metric([], last['tamper'])
+
+        return [gmf_io, gmf_cards, gmf_swiped, gmf_expires, gmf_invalid, gmf_admin, cmf_accepted, cmf_rejected, cmf_dbupdates, cmf_unknown, cmf_tamper]
+
+
+class WebsocketClosed(Exception):
+    pass
 
 
 class Websocket:
@@ -648,8 +872,15 @@ class Websocket:
         self.uri = session.uri
         self.wssuri = f'{self.uri}/views/EventHandlerIntf/'.replace('https', 'wss', 1)
         self.websocket = None
+        self._reader_task = None
+        self._frames = None
 
     async def async_close(self):
+        if self._reader_task:
+            self._reader_task.cancel()
+            # wait for it to finish, so it can't touch the websocket we close
+            await asyncio.gather(self._reader_task, return_exceptions=True)
+            self._reader_task = None
         if self.websocket:
             LOGGER.info(f'closing websocket for {self.uri}')
             await self.websocket.close()
@@ -658,7 +889,6 @@ class Websocket:
     async def async_open(self):
         if self.websocket:
             return
-        self.readlock, self.writelock = asyncio.Lock(), asyncio.Lock()
         LOGGER.info(f'opening websocket for {self.uri}')
         sslcontext = ssl.SSLContext(ssl.PROTOCOL_TLS_CLIENT)
         sslcontext.load_verify_locations(self.session.verify)
@@ -674,78 +904,114 @@ class Websocket:
         except websockets.exceptions.InvalidStatusCode:
             LOGGER.info(f'{self.uri} rejected websocket connection; reopening underlying session')
             self.session.request_reopen = True
+            return
+        self._start_reader()
+
+    def _start_reader(self):
+        # One task owns the websocket: it reads and decodes every frame and
+        # is the only writer, so neither direction needs a lock.
+        self._frames = asyncio.Queue(maxsize=1024)
+        self._reader_task = asyncio.create_task(self._read_frames())
+
+    async def _read_frames(self):
+        """Runs as a task, putting each decoded frame on self._frames. A frame
+        we can't make sense of is logged and skipped; only a failure of the
+        websocket itself stops us. Then we put the ConnectionClosedError that
+        ended it, or None (which read_event() raises as WebsocketClosed).
+        """
+        try:
+            async for message in self.websocket:
+                try:
+                    js = _loads(message.replace("'", '"'))
+                    if not isinstance(js, list):
+                        LOGGER.warning(f'{self.uri}: ignoring unknown frame {message!r}')
+                        continue
+                    if len(js) == 2 and js[0] == 'setCid':
+                        cid = int(js[1])
+                        LOGGER.debug(f'onConnect.cid={cid}')
+                        await self.write_message('luaNS4Client2ServerIntf;setIOState;dddd;1;1;0;1;;')
+                    else:
+                        await self._frames.put(js)
+                except (asyncio.CancelledError, websockets.exceptions.ConnectionClosed):
+                    raise
+                except Exception as ex:
+                    LOGGER.warning(f'{self.uri}: ignoring frame {message!r}: {ex}')
+            ended = None
+        except asyncio.CancelledError:
+            raise
+        except websockets.exceptions.ConnectionClosedError as ex:
+            ended = ex
+        except Exception as ex:
+            LOGGER.error(f'{self.uri}: error reading websocket', exc_info=ex)
+            ended = None
+        await self._frames.put(ended)
 
     async def write_message(self, message):
-        assert self.websocket  # must call async_open() first
+        if self.websocket is None:
+            raise NetaxsError(f'websocket for {self.uri} is not open')
         LOGGER.debug(f'sending {message} on {self.wssuri}')
-        async with self.writelock:
-            return await self.websocket.send(message)
+        return await self.websocket.send(message)
 
     async def read_event(self):
-        assert self.websocket
-        async with self.readlock:
-            async for message in self.websocket:
-                js = json.loads(message.replace("'", '"'))
-                if len(js) == 2:
-                    if js[0] == 'setCid':
-                        cid = int(js[1])
-                        LOGGER.debug(f'onConnect.cid={cid}')
-                        await self.write_message('luaNS4Client2ServerIntf;setIOState;dddd;1;1;0;1;;')
-                        continue
-                elif len(js) == 4:
-                    if js[0] == 'ud' and js[1] == 'luaNS4Server2ClientIntf':
-                        if js[2] == 'asyncLogoff' and len(js[3]) == 1:
-                            logoff_minutes = js[3][0]
-                            return { js[2]: logoff_minutes }
-                        elif js[2] == 'asyncSetIOState':
-                            # js[3] [1,26,1,1,0]
-                            return { js[2]: js[3] }
-                        elif js[2] == 'asyncSendNewEvent':
-                            (panel, datestr, evid, device, zero, logical, physical, typeint, code, site, lastname, secondzero, last) = js[3]
-                            ts = self.session._localize(datetime.strptime(datestr.replace('\\/', '/').strip(), '%m/%d/%Y %H:%M:%S')).timestamp()
-                            desc = ''
-                            if typeint == 1: # and subtypeint == 0
-                                if int(code) and site:
-                                    desc = 'Card Found'
-                            elif typeint == 2: # and subtypeint == 1:
-                                if site == 0:
-                                    desc = 'Card Not Found'
-                            elif typeint == 5:
-                                desc = 'Timezone Violation'
-                            elif typeint == 12: # and subtypeint == 0:
-                                desc = 'VIP Card Found'
-                            elif typeint == 11: # and subtypeint == 1:
-                                desc = 'Card Not Found: expired'
-                            if not desc:
-                                LOGGER.error(f'unknown event {js[3]}')
-                                desc = 'unknown event'
-                            return { js[2]: {
-                                'id': int(evid),
-                                'panel': panel,
-                                'when': ts,
-                                'reader': device,
-                                'logical': int(logical),
-                                'physical': int(physical),
-                                'description': desc,
-                                'code': code,
-                                'site': site,
-                                'name': lastname,
-                            } }
-                LOGGER.warning(f'unknown message from {self.wssuri}: {js}')
-
-    def process_event(self, ev):
+        if self.websocket is None:
+            raise NetaxsError(f'websocket for {self.uri} is not open')
+        while True:
+            js = await self._frames.get()
+            if js is None or isinstance(js, Exception):
+                # the reader has stopped, so leave this for any later call
+                # rather than having it wait for frames that won't come
+                self._frames.put_nowait(js)
+                if js is None:
+                    raise WebsocketClosed(self.wssuri)
+                raise js
+            if len(js) == 4:
+                if js[0] == 'ud' and js[1] == 'luaNS4Server2ClientIntf':
+                    if js[2] == 'asyncLogoff' and len(js[3]) == 1:
+                        logoff_minutes = js[3][0]
+                        return { js[2]: logoff_minutes }
+                    elif js[2] == 'asyncSetIOState':
+                        # js[3] [1,26,1,1,0]
+                        return { js[2]: js[3] }
+                    elif js[2] == 'asyncSendNewEvent':
+                        (panel, datestr, evid, device, zero, logical, physical, typeint, code, site, lastname, secondzero, last) = js[3]
+                        ts = self.session._timestamp(_parse_mdy_hms(datestr.replace('\\/', '/')))
+                        (desc, kind) = _WS_EVENT_DESC.get(typeint, (None, KIND_UNKNOWN))
+                        if typeint == 1 and not (int(code) and site):
+                            desc = None
+                        elif typeint == 2 and site != 0:
+                            desc = None
+                        if not desc:
+                            LOGGER.error(f'unknown event {js[3]}')
+                            (desc, kind) = ('unknown event', KIND_UNKNOWN)
+                        return { js[2]: Event(int(evid), ts, panel, device, int(logical), int(physical), desc, kind, code, lastname, site) }
+            LOGGER.warning(f'unknown message from {self.wssuri}: {js}')
+
+    async def process_event(self, ev):
+        """Applies ev to our session. That takes the session's lock, which a
+        scrape or background refresh holds across slow panel requests, so
+        the work runs on a worker thread instead of blocking the event loop
+        (and everyone else's coroutines) while we wait for the lock."""
+        loop = asyncio.get_running_loop()
         logoff_minutes = (ev or {}).get('asyncLogoff')
         if logoff_minutes is not None:
             LOGGER.debug(f'{self.uri}: asyncLogoff in {logoff_minutes} min')
             if logoff_minutes < 2:
                 LOGGER.debug(f'{self.uri}: updating cards for keepalive')
-                with self.session.cv:
-                    self.client._update_cards(self.session, time.time())
+                await loop.run_in_executor(None, self._keepalive)
         newevent = (ev or {}).get('asyncSendNewEvent')
         if newevent:
             LOGGER.debug(f'{self.uri}: new async event {newevent}')
-            with self.client.cv:
-                self.client._update_one_event(self.session, newevent)
+            await loop.run_in_executor(None, self._apply_event, newevent)
+
+    def _keepalive(self):
+        with self.session.cv:
+            self.client._update_cards(self.session, time.time())
+
+    def _apply_event(self, event):
+        # last_porter belongs to the session, so take its lock (as
+        # collect() does) rather than the client's
+        with self.session.cv:
+            self.client._update_one_event(self.session, event)
 
     async def _coro_for_session(self):
         """Runs as a task and awaits asynchronous messages for self.session.
@@ -770,14 +1036,14 @@ class Websocket:
                 last['successful_io_timestamp'] = max(
                     time.time(), last['successful_io_timestamp']
                 )
-                self.process_event(ev)
+                await self.process_event(ev)
             except asyncio.TimeoutError:
                 LOGGER.info(f'{self.uri}: timeout reading websocket')
                 await self.async_close()
                 await asyncio.sleep(2)  # rate limiting
                 return self._coro_for_session()  # reopen
-            except websockets.exceptions.ConnectionClosedError:
-                self.websocket = None
+            except (websockets.exceptions.ConnectionClosedError, WebsocketClosed):
+                await self.async_close()
                 return self._coro_for_session()  # reopen
             except Exception as ex:
                 LOGGER.error(f'{self.uri}: error reading websocket', exc_info=ex)
@@ -805,6 +1071,7 @@ if __name__ == '__main__':
     assert len(sys.argv) == 3, sys.argv
     config = yaml.safe_load(open(sys.argv[1]))
     logging.basicConfig(level=logging.INFO)
+    install_uvloop()
     client = NetaxsClient(config, EventbusStub())
     target = sys.argv[2]
 
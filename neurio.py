@@ -9,6 +9,7 @@
 import requests, prometheus_client, time
 
 from prometheus_client.core import GaugeMetricFamily
+from requests.adapters import HTTPAdapter
 
 REQUEST_TIME = prometheus_client.Summary('neurio_processing_seconds',
                                          'time of neurio requests')
@@ -34,52 +35,43 @@ REQUEST_TIME = prometheus_client.Summary('neurio_processing_seconds',
 
 config = None # set by caller
 
+# sensors are scraped often, so keep their connections alive between scrapes
+_SESSION = requests.Session()
+_SESSION.mount('http://', HTTPAdapter(pool_maxsize=16))
+_SESSION.mount('https://', HTTPAdapter(pool_maxsize=16))
+DEFAULT_TIMEOUT = 10 # seconds; override with "timeout" in the neurio section
+
+# channel type prefix => phase label
+_PHASES = { 'phase_a_': 'A', 'phase_b_': 'B', 'phase_c_': 'C' }
+
 @REQUEST_TIME.time()
 def collect(target):
-    metric_to_gauge = {}
-    def makegauge(metric, desc, labels=[]):
-        already = metric_to_gauge.get(metric)
-        if already:
-            return already
-        alllabels = ['sensor', 'phase', 'function'] + labels
-        gmf = GaugeMetricFamily(metric, desc, labels=alllabels)
-        metric_to_gauge[metric] = gmf
-        return gmf
+    labelnames = ['sensor', 'phase', 'function']
+    g_imp = GaugeMetricFamily('imported_energy_ws', 'imported energy (Watt-seconds)', labels=labelnames)
+    g_exp = GaugeMetricFamily('exported_energy_ws', 'exported energy (Watt-seconds)', labels=labelnames)
+    g_p = GaugeMetricFamily('power_w', 'instantaneous real power (Watts)', labels=labelnames)
+    g_var = GaugeMetricFamily('instantaneous_var', 'instantaneous reactive power (Volt-Amps reactive)', labels=labelnames)
+    g_v = GaugeMetricFamily('instantaneous_v', 'instantaneous voltage', labels=labelnames)
 
     targ = target if target.startswith('http') else 'http://%s' % target
-    resp = requests.get('%s/current-sample' % targ)
+    timeout = ((config or {}).get('neurio') or {}).get('timeout', DEFAULT_TIMEOUT)
+    resp = _SESSION.get('%s/current-sample' % targ, timeout=timeout)
     resp.raise_for_status()
     js = resp.json()
     sensorid = js.get('sensorId', '')
     for channel in js.get('channels', []):
         t = channel.get('type', '').lower()
-        if t.startswith('phase_a_'):
-            phase = 'A'
-            f = t[8:]
-        elif t.startswith('phase_b_'):
-            phase = 'B'
-            f = t[8:]
-        elif t.startswith('phase_c_'):
-            phase = 'C'
+        phase = _PHASES.get(t[:8])
+        if phase:
             f = t[8:]
         else:
             phase = 'total'
             f = t
         labels = [sensorid, phase, f]
-        
-        g = makegauge('imported_energy_ws', 'imported energy (Watt-seconds)')
-        g.add_metric(labels, int(channel['eImp_Ws']))
-
-        g = makegauge('exported_energy_ws', 'exported energy (Watt-seconds)')
-        g.add_metric(labels, int(channel['eExp_Ws']))
-
-        g = makegauge('power_w', 'instantaneous real power (Watts)')
-        g.add_metric(labels, int(channel['p_W']))
- 
-        g = makegauge('instantaneous_var', 'instantaneous reactive power (Volt-Amps reactive)')
-        g.add_metric(labels, int(channel['p_W']))
-
-        g = makegauge('instantaneous_v', 'instantaneous voltage')
-        g.add_metric(labels, float(channel['v_V']))
+        g_imp.add_metric(labels, int(channel['eImp_Ws']))
+        g_exp.add_metric(labels, int(channel['eExp_Ws']))
+        g_p.add_metric(labels, int(channel['p_W']))
+        g_var.add_metric(labels, int(channel['q_VAR']))
+        g_v.add_metric(labels, float(channel['v_V']))
 
-    return metric_to_gauge.values()
+    return [g_imp, g_exp, g_p, g_var, g_v]
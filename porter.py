@@ -44,6 +44,7 @@ TODO: serve /config to dump the configuration
 import asyncio, json, logging, prometheus_client, requests, threading, sys, time, yaml
 from prometheus_client.core import GaugeMetricFamily
 from prometheus_client.registry import REGISTRY
+from concurrent.futures import ThreadPoolExecutor
 from subprocess import TimeoutExpired
 
 import ambientweather, combox, flo, lutron, nest, netaxs
@@ -53,7 +54,12 @@ import smartthings, tankutility, tesla, totalconnect
 from brainstem import Brainstem
 from sshproxy import SSHProxy
 from prometheus import start_wsgi_server, SilentException
-from asynchelpers import AsyncPollingLoop
+from asynchelpers import AsyncPollingLoop, install_uvloop
+
+try:
+    from yaml import CSafeLoader as YamlLoader # libyaml, if PyYAML was built with it
+except ImportError:
+    from yaml import SafeLoader as YamlLoader
 
 
 class RequestError(Exception):
@@ -77,17 +83,33 @@ class ProbeCollector(object):
         self.config = config
         self.sshproxy = sshproxy
         self.module_to_client = module_to_client
+        workers = config.get('probe_workers')
+        self.pool = ThreadPoolExecutor(workers, 'probe') if workers and workers > 1 else None
 
     def collect(self):
         return iter([])
 
-    @REQUEST_EXCEPTION_COUNT.count_exceptions()
     def _probe_collect2(self, module, targets):
-        client = self.module_to_client.get(module)
-        if client:
-            return [client.collect(self.sshproxy.rewrite(t)) for t in targets]
-        else:
-            raise RequestError('unknown module %s' % module)
+        """Yields each target's metrics as soon as they are collected."""
+        # a generator, so count exceptions while it runs rather than when
+        # it is called (which only creates it)
+        with REQUEST_EXCEPTION_COUNT.count_exceptions():
+            client = self.module_to_client.get(module)
+            if not client:
+                raise RequestError('unknown module %s' % module)
+            if self.pool and len(targets) > 1:
+                # collect() may return a generator, so finish it in the worker
+                futures = [self.pool.submit(lambda t: list(client.collect(t)), self.sshproxy.rewrite(t))
+                           for t in targets]
+                try:
+                    for f in futures:
+                        yield from f.result()
+                finally:
+                    for f in futures:
+                        f.cancel()
+            else:
+                for t in targets:
+                    yield from client.collect(self.sshproxy.rewrite(t))
 
     def collect2(self, path, params):
         targets = params.get('target', [])
@@ -98,9 +120,7 @@ class ProbeCollector(object):
             raise RequestError('no targets specified')
         try:
             if module and path.startswith('/probe'):
-                for targetlist in self._probe_collect2(module, targets):
-                    for metric in targetlist:
-                        yield metric
+                yield from self._probe_collect2(module, targets)
                 return # return now if everything went well
             else:
                 raise RequestError('unknown request %s %s' % (path, params))
@@ -114,21 +134,18 @@ class ProbeCollector(object):
         except requests.exceptions.ConnectionError as e:
             CONNECT_FAIL_COUNT.inc()
             for t in targets:
-                if self.sshproxy.rewrite(t) != t:
-                    self.sshproxy.restart_proxy_for(t)
+                # a no-op for targets that aren't proxied; don't call rewrite()
+                # here, since that brings the proxy up and counts a request
+                self.sshproxy.restart_proxy_for(t)
             LOGGER.info(f'during {path} {params} caught ConnectionError: {str(e)}')
             raise SilentException() # just fail the request, no more logging
-        except requests.exceptions.HTTPError as e:
+        except (requests.exceptions.HTTPError, TimeoutExpired) as e:
             BAD_RESPONSE_COUNT.inc()
-            LOGGER.info(f'during {path} {params} caught HTTPError: {str(e)}')
+            LOGGER.info(f'during {path} {params} caught {type(e).__name__}: {str(e)}')
             raise SilentException() # just fail the request, no more logging
         except RequestError as e:
             BAD_REQUEST_COUNT.inc()
             self.log(e, path, params)
-        except TimeoutExpired as e:
-            BAD_RESPONSE_COUNT.inc()
-            LOGGER.info(f'during {path} {params} caught subprocess.TimeoutExpired: {str(e)}')
-            raise SilentException() # just fail the request, no more logging
 
         yield GaugeMetricFamily('ignore', 'ignore')
 
@@ -198,6 +215,10 @@ class Porter:
         if awaitables:
             def loop():
                 async def async_loop():
+                    if sys.version_info >= (3, 12):
+                        # most of our tasks finish or block on I/O right away, so
+                        # run them eagerly instead of scheduling them first
+                        asyncio.get_running_loop().set_task_factory(asyncio.eager_task_factory)
                     poller = AsyncPollingLoop('main', awaitables)
                     LOGGER.info(f'started async polling loop, awaiting {len(awaitables)}')
                     while True:
@@ -234,11 +255,15 @@ def main(args):
     if len(args) > 1:
         configfile = args[1]
 
-    config = yaml.safe_load(open(configfile, 'rt')) or {}
+    with open(configfile, 'rb') as f:
+        config = yaml.load(f, Loader=YamlLoader) or {}
     if config:
         LOGGER.info(f'using configuration file {configfile}')
     else:
         LOGGER.info(f'configuration file {configfile} was empty; ignored')
+    # Porter() starts the async polling loop, so pick the loop implementation first
+    if install_uvloop():
+        LOGGER.info('using uvloop')
     p = Porter(config)
     p.start_wsgi_server()
 
@@ -2,7 +2,7 @@
 
 from __future__ import unicode_literals
 
-import copy, html, io, logging, threading
+import html, io, logging, threading
 LOGGER = logging.getLogger('porter.prometheus')
 
 from datetime import datetime
@@ -28,21 +28,16 @@ def registry_view_factory(parent, path, params):
             collectors = None
             ti = None
             with parent._lock:
-                collectors = copy.copy(parent._collector_to_names)
+                collectors = tuple(parent._collector_to_names)
                 if parent._target_info:
                     ti = parent._target_info_metric()
             if ti:
                 yield ti
 
             for collector in collectors:
-                collect2_func = None
-                try:
-                    collect2_func = collector.collect2
-                except AttributeError:
-                    pass
+                collect2_func = getattr(collector, 'collect2', None)
                 if collect2_func:
-                    for metric in collector.collect2(path, params):
-                        yield metric
+                    yield from collect2_func(path, params)
                 # the only zero-argument collect collectors we have here are the default ones
                 # and they should not be emitted for /probe queries
                 #else:
@@ -0,0 +1,210 @@
+"""
+test_netaxs.py
+
+Tests event paging, timestamps, and event dispatch against a stub panel
+that returns canned getEvents.lsp pages.
+"""
+
+import json
+import netaxs
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from unittest.mock import patch
+from zoneinfo import ZoneInfo
+
+TZ = 'America/Los_Angeles'
+
+
+def ts(dtime):
+    return dtime.replace(tzinfo=ZoneInfo(TZ)).timestamp()
+
+
+def row(evid, dtime, evtype=1, evsubtype=0, space=0, lp=1, code='123', name='Doe'):
+    """Returns one event in the 14-field format of getEvents.lsp."""
+    timedict = {'year': dtime.year, 'month': dtime.month, 'day': dtime.day,
+                'hour': dtime.hour, 'min': dtime.minute, 'sec': dtime.second}
+    return [1, evid, str(evtype), str(evsubtype), space, lp, lp, 0, 'r1', code, name, timedict, 0, 1]
+
+
+class Response:
+    def __init__(self, content):
+        self.content = content.encode()
+        self.status_code = 200
+    def raise_for_status(self):
+        pass
+
+
+class PanelStub:
+    """Stands in for the requests session. Serves self.rows (newest first)
+    in pages of the size and offset the filter asks for."""
+    def __init__(self, rows):
+        self.rows = rows
+        self.headers, self.cookies = {}, {}
+        self.posts = []
+        self.on_post = None
+    def post(self, url, data=None, timeout=None):
+        assert 'getEvents.lsp' in url, url
+        f = json.loads(data['filter'])
+        self.posts.append((f['l'], f['o']))
+        page = self.rows[f['o']:f['o']+f['l']]
+        if self.on_post:
+            self.on_post(self)
+        return Response(json.dumps([field for r in page for field in r]))
+    def close(self):
+        pass
+
+
+class FakeSession(netaxs.Session):
+    def open(self):
+        self.logged_in = True
+
+
+class EventbusStub:
+    def __init__(self):
+        self.propagated = []
+    def propagate(self, *args):
+        self.propagated.append(args)
+    def add_awaitables_to(self, otherset):
+        pass
+    def target(self, t):
+        return self
+
+
+@contextmanager
+def panel_session():
+    """Yields a client and its session for a panel that is never contacted;
+    tests give the session a PanelStub to talk to."""
+    config = {'netaxs': {'panel': {'user': 'mine', 'password': 'yes', 'timezone': TZ}}}
+    client = netaxs.NetaxsClient(config, EventbusStub())
+    with patch.object(netaxs, 'Session', FakeSession):
+        session = client._get_session('panel')
+    try:
+        yield client, session
+    finally:
+        for coro in client.awaitables:
+            coro.close()
+
+
+newest = datetime(2021, 7, 19, 9, 32, 49)
+def minutes_ago(n):
+    return newest - timedelta(minutes=n)
+
+
+def test_short_page():
+    # one request, and the next page size shrinks to fit
+    with panel_session() as (client, session):
+        session.session = PanelStub([row(500-i, minutes_ago(i)) for i in range(5)])
+        events = client._fetch_events(session, ts(minutes_ago(60)))
+        assert [e.id for e in events] == [500, 499, 498, 497, 496], events
+        assert session.session.posts == [(netaxs.MAX_EVENTS, 0)], session.session.posts
+        assert session.events_page_size == netaxs.MIN_EVENTS_PAGE, session.events_page_size
+        assert events[0].when == ts(newest), (events[0].when, ts(newest))
+
+
+def test_full_page_past_notbefore():
+    with panel_session() as (client, session):
+        # the panel would happily follow this page with more, but it stops
+        # at notbefore: still one request
+        session.events_page_size = 16
+        session.session = PanelStub([row(500-i, minutes_ago(i)) for i in range(40)])
+        events = client._fetch_events(session, ts(minutes_ago(9)))
+        assert len(events) == 10 and events[-1].id == 491, events
+        assert session.session.posts == [(16, 0)], session.session.posts
+
+        # a full page and then one that goes past notbefore; an event arriving
+        # between the two shifts the second page, which must not repeat events
+        session.events_page_size = 16
+        stub = session.session = PanelStub([row(500-i, minutes_ago(i)) for i in range(40)])
+        def new_event_arrives(stub):
+            stub.rows.insert(0, row(501, newest + timedelta(seconds=5)))
+            stub.on_post = None
+        stub.on_post = new_event_arrives
+        events = client._fetch_events(session, ts(minutes_ago(19)))
+        assert [e.id for e in events] == list(range(500, 480, -1)), [e.id for e in events]
+        assert stub.posts == [(16, 0), (16, 16)], stub.posts
+        assert session.events_page_size == 40, session.events_page_size
+
+
+def test_max_events():
+    # full pages all the way back: we stop at MAX_EVENTS, asking only for
+    # what fits in the last page
+    with panel_session() as (client, session):
+        session.events_page_size = 150
+        stub = session.session = PanelStub([row(1000-i, minutes_ago(i)) for i in range(400)])
+        events = client._fetch_events(session, ts(minutes_ago(500)))
+        assert len(events) == netaxs.MAX_EVENTS, len(events)
+        assert events[-1].id == 1000 - netaxs.MAX_EVENTS + 1, events[-1]
+        assert stub.posts == [(150, 0), (netaxs.MAX_EVENTS - 150, 150)], stub.posts
+        assert session.events_page_size == netaxs.MAX_EVENTS, session.events_page_size
+
+
+def test_timestamp_dst():
+    # timestamps match zoneinfo on ordinary days and on both DST transition
+    # days, including the skipped and the repeated hours
+    with panel_session() as (client, session):
+        for dtime in [datetime(2021, 7, 19, 9, 32, 49), datetime(2021, 7, 19, 23, 59, 59),
+                      datetime(2021, 3, 14, 1, 30), datetime(2021, 3, 14, 2, 30),
+                      datetime(2021, 3, 14, 3, 30), datetime(2021, 11, 7, 0, 30),
+                      datetime(2021, 11, 7, 1, 30), datetime(2021, 11, 7, 2, 30),
+                      datetime(2021, 11, 7, 23, 0)]:
+            assert session._timestamp(dtime) == ts(dtime), (dtime, session._timestamp(dtime), ts(dtime))
+        assert session._day_offsets[datetime(2021, 3, 14).toordinal()] is False
+        assert session._day_offsets[datetime(2021, 11, 7).toordinal()] is False
+        assert session._day_offsets[datetime(2021, 7, 19).toordinal()] == -7*3600
+        # and a second lookup on a transition day comes from the cache
+        assert session._timestamp(datetime(2021, 11, 7, 1, 30)) == ts(datetime(2021, 11, 7, 1, 30))
+
+
+def test_event_kinds():
+    # each (type, subtype) maps to its kind, and each kind to its counter
+    with panel_session() as (client, session):
+        session.session = PanelStub([
+            row(608, minutes_ago(0), 1, 0, code='123'),
+            row(607, minutes_ago(1), 1, 0, code='0', name=''),
+            row(606, minutes_ago(2), 2, 1, space=1, code='0', name=''),
+            row(605, minutes_ago(3), 2, 1, lp=2, code='77', name=''),
+            row(604, minutes_ago(4), 12, 0, code='124', name='Roe'),
+            row(603, minutes_ago(5), 5, 1, lp=3),
+            row(602, minutes_ago(6), 1, 2, lp=0, code='0', name=''),
+            row(601, minutes_ago(7), 99, 3, code='0', name=''),
+            row(600, minutes_ago(8), 2, 7, code='0', name=''),
+            row(599, minutes_ago(9), 1, 7, code='0', name=''),
+        ])
+        events = session.get_events(notbefore=ts(minutes_ago(60)))
+        assert [(e.description, e.kind) for e in events] == [
+            ('Card Found', netaxs.KIND_CARD_FOUND),
+            ('online', netaxs.KIND_ONLINE),
+            ('TAMPER', netaxs.KIND_TROUBLE),
+            ('Card Not Found', netaxs.KIND_CARD_NOT_FOUND),
+            ('VIP Card Found', netaxs.KIND_VIP_CARD_FOUND),
+            ('timezone violation', netaxs.KIND_TIMEZONE),
+            ('common database update', netaxs.KIND_DATABASE_UPDATE),
+            ('unknown type 99 subtype 3', netaxs.KIND_UNKNOWN),
+            ('unknown type 2 [offline, not found, bad] subtype 7', netaxs.KIND_TROUBLE),
+            ('unknown type 1 [good, found, success] subtype 7', netaxs.KIND_UNKNOWN),
+        ], events
+
+        last = session.last_porter
+        last['timestamp'] = 0
+        for e in reversed(events):
+            client._update_one_event(session, e)
+        assert last['cardfound'][False]['1/1'] == 1, last['cardfound']
+        assert last['cardfound'][True]['1/1'] == 1, last['cardfound']
+        assert last['cardnotfound']['2/2'] == 1, last['cardnotfound']
+        assert last['timezone']['3/3'] == 1, last['timezone']
+        assert last['rejected']['2/2'] == 1 and last['rejected']['3/3'] == 1, last['rejected']
+        assert last['dbupdates']['0/0'] == 1, last['dbupdates']
+        assert last['tamper'] == 2 and last['unknowneventtypes'] == 2, last
+        assert sorted(last['cards']) == [123, 124], last['cards']
+        assert last['eventid'] == 608 and last['timestamp'] == ts(newest), last
+        assert len(client.eventbus.propagated) == len(events), client.eventbus.propagated
+
+
+if __name__ == '__main__':
+    test_short_page()
+    test_full_page_past_notbefore()
+    test_max_events()
+    test_timestamp_dst()
+    test_event_kinds()
+    print('success')